@@ -4,16 +4,99 @@
 """
 
 from boutdata.data import BoutData
-from .pyxpad_utils import XPadDataItem, XPadDataDim
+from boutdata import collect
+from .pyxpad_utils import XPadDataItem, XPadDataDim, UniformDim
+from .datafile import handles, libraryLock
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import os
+import threading
+
+import numpy as np
+
+# Maximum number of runs with BoutData open at once
+maxOpenRuns = 8
+
+_openRuns = OrderedDict()  # Sources with data open, least recently used first
+_openRunsLock = threading.Lock()
+
+_pool = None  # Worker processes for parallel reads, kept between reads
+_poolWorkers = 0
+_poolLock = threading.Lock()
+
+
+def hasDumpFiles(names):
+    """
+    True if a directory listing contains BOUT++ dump files
+    """
+    return any(name.startswith("BOUT.dmp.") for name in names)
+
+
+def indexRange(index):
+    """
+    (start, end) inclusive from an index as given to collect: a single
+    index, [start, end], or a slice with step 1. None for the whole
+    range, or if the index can't be converted
+    """
+    if index is None:
+        return None
+    if isinstance(index, slice):
+        if index.step not in (None, 1) or (index.start or 0) < 0 or \
+           (index.stop is not None and index.stop < 1):
+            return None
+        return (index.start or 0, None if index.stop is None else index.stop - 1)
+    if np.ndim(index) == 0:
+        return (int(index), int(index))
+    if len(index) == 2 and index[0] >= 0 and index[1] >= index[0]:
+        return (int(index[0]), int(index[1]))
+    return None
+
+
+def submitCollects(nworkers, name, jobs):
+    """
+    Run collect(name, **kwargs) for each kwargs in jobs on a pool of
+    at least nworkers processes. Returns the pool and a list of futures
+
+    The pool is started when first needed and kept, so that each read
+    doesn't start new processes. The workers run boutdata's collect
+    directly, so they only import boutdata (and the main script, as
+    for any spawned process), not pyxpad
+    """
+    global _pool, _poolWorkers
+    with _poolLock:
+        if _pool is None or _poolWorkers < nworkers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)  # Reads in progress still finish
+            # Spawn, since forking a threaded GUI process isn't safe
+            context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=nworkers, mp_context=context)
+            _poolWorkers = nworkers
+        try:
+            return _pool, [_pool.submit(collect, name, **kwargs) for kwargs in jobs]
+        except BrokenProcessPool:
+            _pool = None
+            raise
+
+
+def discardPool(pool):
+    """Stop using a pool which is broken, e.g. a worker was killed"""
+    global _pool
+    with _poolLock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
 
 
 class BoutDataSource:
     """
 
     Functions
-      read( name, shot )   Input variable name (string)
+      read( name, shot, tind=None, xind=None, yind=None, zind=None )
+                     Input variable name (string), and optional
+                     index ranges as for boutdata.collect.
                      Output is an XPadDataItem object or None
 
       size( name )   Returns variable size as a list. [] for scalar
@@ -23,60 +106,280 @@ class BoutDataSource:
       label         A short string to describe the source
       dimensions    A dictionary of XPadDataDim objects
       varNames      A list of variable names
-      variables     A dictionary of XPadDataItem objects with empty data
+      variables     A dictionary of XPadVarInfo objects
+
+    Subdirectories are found one level at a time, when the children
+    are first needed, and the BoutData for a run is only opened when
+    first used. At most maxOpenRuns runs are kept open.
 
+    Reads spanning several processors in X are split between
+    'Parallel reads' worker processes, each reading its own
+    processors' dump files. The processes are kept between reads.
+    Reads in this process hold the NetCDF library lock for one
+    processor in X at a time.
     """
+
+    _data = None
+    _children = None
+
     def __init__(self, path, parent=None):
         self.label = path
+        self.path = path
 
         self.parent = parent
-        self.children = []
 
         # List the directory
         ls = os.listdir(path)
+        self.hasData = hasDumpFiles(ls)
+        self._subdirs = [name for name in ls
+                         if os.path.isdir(os.path.join(path, name))]
+
+        if not self.hasData and len(self._subdirs) == 0:
+            raise ValueError("No data in directory " + path)
 
-        for name in ls:
-            fullname = os.path.join(path, name)
-            if os.path.isdir(fullname):
+        self.dimensions = {}
+        self.variables = {}
+        self.config = {'Parallel reads': 4}
+
+    @property
+    def children(self):
+        if self._children is None:
+            children = []
+            for name in self._subdirs:
+                fullname = os.path.join(self.path, name)
                 try:
-                    c = BoutDataSource(fullname, parent=self)
-                    self.children.append(c)
+                    children.append(BoutDataSource(fullname, parent=self))
                 except:
                     print("No data in directory "+fullname)
+            self._children = children
+        return self._children
 
-        self.label = path
-        self.dimensions = {}
-        self.varNames = []
-        self.variables = {}
+    def hasChildren(self):
+        return len(self._subdirs) > 0
+
+    @property
+    def data(self):
+        """
+        The BoutData object for this run, opened if needed
+        """
+        data = self._data
+        if data is None:
+            if not self.hasData:
+                raise ValueError("No data in directory " + self.path)
+            data = BoutData(self.path)
+        with _openRunsLock:
+            if self._data is None:
+                self._data = data
+            _openRuns[id(self)] = self
+            _openRuns.move_to_end(id(self))
+            # Close the least recently used runs
+            while len(_openRuns) > maxOpenRuns:
+                _, source = _openRuns.popitem(last=False)
+                source._data = None
+            return self._data
+
+    @property
+    def varNames(self):
+        if not self.hasData:
+            return []
+        varNames = list(self.data.varNames)
+        for i, v in enumerate(varNames):
+            try:
+                # This is for Python 2.x. Python 3.x will raise a NameError
+                # since unicode -> str and str -> bytes
+                if isinstance(v, unicode):
+                    v = v.encode('utf-8')
+                v = str(v).translate(None, '\0')
+            except NameError:
+                if isinstance(v, bytes):
+                    v = v.decode('utf-8')
+                v = v.replace('\0', '')
+
+            varNames[i] = v
+        return varNames
+
+    def __getstate__(self):
+        # Runs are re-opened when needed
+        state = self.__dict__.copy()
+        state.pop('_data', None)
+        return state
+
+    def __setstate__(self, state):
+        if 'children' in state:
+            # Saved before runs were opened lazily
+            state['_children'] = state.pop('children')
+            state['_subdirs'] = [os.path.basename(c.path) for c in state['_children']]
+            state['hasData'] = 'data' in state
+            state['path'] = state['label']
+            state.pop('data', None)
+            state.pop('varNames', None)
+        state.setdefault('config', {'Parallel reads': 4})
+        self.__dict__.update(state)
+
+    def readKey(self, name, shot):
+        """
+        Identifies the data read, so that identical reads of the
+        same version of the dump files can be shared. The files
+        change while the run is still going
+        """
+        if not self.hasData:
+            return None
+        mtimes = tuple(os.path.getmtime(os.path.join(self.path, f))
+                       for f in sorted(os.listdir(self.path))
+                       if f.startswith("BOUT.dmp."))
+        return (os.path.abspath(self.path), mtimes, str(name))
+
+    def dumpFile(self):
+        """Name of the first processor's dump file"""
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith("BOUT.dmp.0."):
+                return os.path.join(self.path, name)
+        raise ValueError("No data in directory " + self.path)
+
+    def layout(self, name):
+        """
+        Dimension names of a variable, and the processor layout
+        (NXPE, MXSUB, MXG), read from the first dump file.
+        None if the dump files aren't NetCDF
+        """
+        filename = self.dumpFile()
+        if not filename.endswith(".nc"):
+            return None
+        with handles.dataset(filename) as f:
+            if name not in f.variables:
+                return None
+            dimnames = [str(d) for d in f.variables[name].dimensions]
+            layout = [int(np.asarray(f.variables[v][...]))
+                      if v in f.variables else None
+                      for v in ("NXPE", "MXSUB", "MXG")]
+        return dimnames, layout
+
+    def xChunks(self, xind, layout, nworkers):
+        """
+        Split an X index range into up to nworkers (start, end) ranges,
+        at processor boundaries, so that each range is read from
+        different dump files
+        """
+        nxpe, mxsub, mxg = layout
+        nx = nxpe * mxsub + 2 * mxg
+        start, end = xind if xind is not None else (0, nx - 1)
+        if end is None:
+            end = nx - 1
+        end = min(end, nx - 1)
+
+        def proc(x):
+            return min(max((x - mxg) // mxsub, 0), nxpe - 1)
+
+        procs = np.arange(proc(start), proc(end) + 1)
+        chunks = []
+        for group in np.array_split(procs, min(nworkers, len(procs))):
+            first = 0 if group[0] == 0 else mxg + group[0] * mxsub
+            last = nx - 1 if group[-1] == nxpe - 1 else mxg + (group[-1] + 1) * mxsub - 1
+            chunks.append((int(max(start, first)), int(min(end, last))))
+        return chunks
+
+    def chunks(self, dimnames, layout, nchunks, **ranges):
+        """
+        Split a read into up to nchunks X index ranges at processor
+        boundaries, or None if it can't be split
+        """
+        xind = indexRange(ranges.get('xind'))
+        if (layout is None or None in layout or dimnames is None or
+                'x' not in dimnames or
+                (ranges.get('xind') is not None and xind is None)):
+            return None
+        chunks = self.xChunks(xind, layout, nchunks)
+        return chunks if len(chunks) > 1 else None
+
+    def collectHere(self, name, dimnames=None, layout=None, **ranges):
+        """
+        Collect a variable in this process. NetCDF isn't thread safe,
+        so the lock shared with other NetCDF reads is held, but only
+        while each processor in X is read, so that one large read
+        doesn't hold up all the others
+        """
+        chunks = self.chunks(dimnames, layout, layout[0] if layout else 1, **ranges)
+        if chunks is None:
+            with libraryLock:
+                return np.asarray(collect(name, path=self.path, info=False, **ranges))
+        parts = []
+        for chunk in chunks:
+            with libraryLock:
+                parts.append(np.asarray(collect(name, path=self.path, info=False,
+                                                **dict(ranges, xind=list(chunk)))))
+        return np.concatenate(parts, axis=dimnames.index('x'))
+
+    def collect(self, name, dimnames, layout, **ranges):
+        """
+        Collect a variable, reading processors in parallel
+        if the range covers more than one in X
+        """
+        nworkers = int(self.config.get('Parallel reads', 1))
+        chunks = None
+        if nworkers > 1:
+            chunks = self.chunks(dimnames, layout, nworkers, **ranges)
+        if chunks is None:
+            return self.collectHere(name, dimnames, layout, **ranges)
+
+        jobs = [dict(ranges, path=self.path, info=False, xind=list(chunk))
+                for chunk in chunks]
+        pool = None
         try:
-            self.data = BoutData(path)
+            pool, futures = submitCollects(nworkers, name, jobs)
+            parts = [np.asarray(future.result()) for future in futures]
+        except BrokenProcessPool:
+            if pool is not None:
+                discardPool(pool)
+            return self.collectHere(name, dimnames, layout, **ranges)
+        return np.concatenate(parts, axis=dimnames.index('x'))
 
-            self.varNames = self.data.varNames
-            for i, v in enumerate(self.varNames):
-                try:
-                    # This is for Python 2.x. Python 3.x will raise a NameError
-                    # since unicode -> str and str -> bytes
-                    if isinstance(v, unicode):
-                        v = v.encode('utf-8')
-                    v = str(v).translate(None, '\0')
-                except NameError:
-                    if isinstance(v, str):
-                        v = v.encode('utf-8')
-
-                self.varNames[i] = v
-        except:
-            # No data in path. Check if any children
-            if len(self.children) == 0:
-                raise
-
-    def read(self, name, shot):
+    def read(self, name, shot, tind=None, xind=None, yind=None, zind=None):
+        """Read a variable from the run.
+
+        tind, xind, yind, zind  Optional ranges of indices in t, x, y
+                                and z: a single index, [start, end]
+                                inclusive, or a slice. Only the dump
+                                files holding the range are read
+        """
         try:
             if isinstance(name, unicode):
                 name = name.encode('utf-8')
+            name = str(name).translate(None, '\0')
         except NameError:
-            pass
-        name = str(name).translate(None, '\0')
+            if isinstance(name, bytes):
+                name = name.decode('utf-8')
+            name = str(name).replace('\0', '')
+
+        ranges = {}
+        for key, index in [('tind', tind), ('xind', xind), ('yind', yind), ('zind', zind)]:
+            if index is not None:
+                ranges[key] = index
+
+        layout = self.layout(name)
+        data = self.collect(name, *(layout or (None, None)), **ranges)
 
-        item = self.data.read(name)
+        if layout is not None and len(layout[0]) == data.ndim:
+            dimnames = layout[0]
+        else:
+            dimnames = ["dim{}".format(i) for i in range(data.ndim)]
 
-        return XPadDataItem(item)
+        item = XPadDataItem()
+        item.name = name
+        item.source = self.path
+        item.data = data
+        item.dim = []
+        for i, dimname in enumerate(dimnames):
+            if dimname == 't':
+                dim = XPadDataDim()
+                dim.data = self.collectHere("t_array", tind=tind)
+                item.order = i
+                item.time = dim.data
+            else:
+                index = indexRange(ranges.get(dimname + 'ind'))
+                start = index[0] if index is not None else 0
+                dim = UniformDim(start, 1, data.shape[i])
+            dim.name = dim.label = dimname
+            if dimname == 't':
+                dim.label = "Time"
+            item.dim.append(dim)
+        return item
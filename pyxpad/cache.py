@@ -0,0 +1,185 @@
+"""
+Persistent on-disk cache of data items
+
+Items are pickled, compressed and stored one per file, named by
+a hash of the key. When the total size exceeds the budget, the
+least recently used files are removed.
+
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+import zlib
+
+import xdg
+
+# Directory for all cached files
+cache_dir = os.path.join(str(xdg.XDG_CACHE_HOME), "pyxpad")
+
+# Default location for cached data
+default_dir = os.path.join(cache_dir, "signals")
+
+_caches = {}  # Shared SignalCache objects, one per directory
+_caches_lock = threading.Lock()
+
+
+def getCache(path=None, maxsize=1024):
+    """
+    Returns the SignalCache for the given directory, creating it if
+    needed. All sources using the same directory share one cache.
+
+    path      Directory to store files in. Default is default_dir
+    maxsize   Size budget in megabytes
+    """
+    if path is None:
+        path = default_dir
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = SignalCache(path)
+        cache = _caches[path]
+    cache.maxsize = int(maxsize) * 1024 * 1024
+    return cache
+
+
+class SignalCache:
+    """
+    A size-limited cache of picklable objects stored on disk
+
+    path      Directory containing the cache files
+    maxsize   Maximum total size of the files in bytes
+    """
+
+    suffix = ".pkz"
+
+    def __init__(self, path, maxsize=1024**3):
+        self.path = path
+        self.maxsize = maxsize
+        self._size = None  # Total size of files. None until scanned
+        self._lock = threading.Lock()
+
+    def filename(self, key):
+        """
+        File which stores the item with the given key
+        """
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + self.suffix)
+
+    def get(self, key):
+        """
+        Returns the item stored for key, or None if not in the cache
+        """
+        fname = self.filename(key)
+        try:
+            with open(fname, 'rb') as f:
+                stored_key, item = pickle.loads(zlib.decompress(f.read()))
+            # Mark as recently used
+            os.utime(fname, None)
+        except (OSError, IOError):
+            return None  # Not in the cache
+        except Exception:
+            # Corrupt or from an incompatible version
+            self._remove(fname)
+            return None
+        if stored_key != key:
+            return None  # Hash collision
+        return item
+
+    def put(self, key, item):
+        """
+        Store an item in the cache, evicting old items if needed.
+        Items which can't be stored, e.g. which can't be pickled or
+        are too large to compress in memory, are not cached
+        """
+        try:
+            data = zlib.compress(pickle.dumps((key, item), pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return  # Caching is only an optimisation
+        if len(data) > self.maxsize:
+            return  # Would never fit
+
+        fname = self.filename(key)
+        # Write to a temporary file then rename, so that readers never
+        # see a partial file
+        tmpname = "{}.{}.{}.tmp".format(fname, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmpname, 'wb') as f:
+                f.write(data)
+            try:
+                oldsize = os.path.getsize(fname)
+            except OSError:
+                oldsize = 0
+            os.replace(tmpname, fname)
+        except (OSError, IOError):
+            self._remove(tmpname)
+            return
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data) - oldsize
+        self.evict()
+
+    def size(self):
+        """
+        Total size of the cache files in bytes
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            return self._size
+
+    def evict(self):
+        """
+        Remove least recently used files until within maxsize
+        """
+        if self.size() <= self.maxsize:
+            return
+        with self._lock:
+            files = sorted(self._scan(), key=lambda f: f[2])  # Oldest first
+            total = sum(size for _, size, _ in files)
+            for fname, size, _ in files:
+                if total <= self.maxsize:
+                    break
+                if self._remove(fname):
+                    total -= size
+            self._size = total
+
+    def clear(self):
+        """
+        Remove all files from the cache
+        """
+        with self._lock:
+            for fname, _, _ in self._scan():
+                self._remove(fname)
+            self._size = 0
+
+    def _scan(self):
+        """
+        List of (filename, size, mtime) for all files in the cache
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            if not name.endswith(self.suffix):
+                continue
+            fname = os.path.join(self.path, name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            files.append((fname, st.st_size, st.st_mtime))
+        return files
+
+    @staticmethod
+    def _remove(fname):
+        try:
+            os.remove(fname)
+            return True
+        except OSError:
+            return False
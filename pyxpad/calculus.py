@@ -3,8 +3,8 @@ Calculus on XPadDataItem objects
 
 """
 
-from .pyxpad_utils import XPadDataItem
-from numpy import zeros, cumsum
+from .pyxpad_utils import XPadDataItem, XPadDataDim, isUniform
+from numpy import zeros, cumsum, asarray, concatenate, searchsorted
 
 
 def integrate(item):
@@ -38,9 +38,13 @@ def integrate(item):
 
     result.data = zeros(item.data.shape)
 
-    time = item.dim[0].data
+    if isUniform(item.dim[0]):
+        # Constant step, so the time values aren't needed
+        result.data[1:] = cumsum(0.5*item.dim[0].step*(item.data[1:] + item.data[0:-1]))
+    else:
+        time = item.dim[0].data
 
-    result.data[1:] = cumsum(0.5*(time[1:]-time[0:-1])*(item.data[1:] + item.data[0:-1]))
+        result.data[1:] = cumsum(0.5*(time[1:]-time[0:-1])*(item.data[1:] + item.data[0:-1]))
 
     result.dim = item.dim
     result.order = item.order
@@ -81,14 +85,79 @@ def differentiate(item):
     result.order = item.order
     result.time = item.time
 
-    time = item.dim[item.order].data
-
     result.data = zeros(len(item.data))
 
-    for i in range(1, len(result.data)-1):
-        result.data[i] = (item.data[i+1]-item.data[i-1])/(time[i+1]-time[i-1])
+    if isUniform(item.dim[item.order]):
+        # Central differences with a constant step
+        data = asarray(item.data)
+        result.data[1:-1] = (data[2:] - data[:-2]) / (2.*item.dim[item.order].step)
+    else:
+        time = item.dim[item.order].data
+
+        for i in range(1, len(result.data)-1):
+            result.data[i] = (item.data[i+1]-item.data[i-1])/(time[i+1]-time[i-1])
 
     result.data[-1] = result.data[-2]
     result.data[0] = result.data[1]
 
     return result
+
+
+def integrateBlocks(blocks):
+    """
+    Integrate a trace given as a sequence of blocks, for example
+    from NetCDFDataSource.blocks(), without holding it all in memory
+
+    Inputs
+    ------
+
+    blocks  - iterable of XPadDataItem objects, consecutive in time.
+              Points repeated from the previous block are skipped
+
+    Returns
+    -------
+
+    generator of XPadDataItem objects, one for each block
+
+    """
+
+    total = 0.0
+    last = None  # (time, value) of the last point integrated
+
+    for item in blocks:
+        if len(item.dim) != 1:
+            raise ValueError("Can only integrate 1D traces currently")
+
+        time = asarray(item.dim[0].data)
+        data = asarray(item.data)
+        if last is not None:
+            # Skip any overlap with the previous block
+            start = searchsorted(time, last[0], side='right')
+            time = concatenate(([last[0]], time[start:]))
+            data = concatenate(([last[1]], data[start:]))
+
+        result = integrate(_withData(item, time, data))
+        result.data += total
+        if last is not None:
+            # First point repeats the end of the previous block
+            result.data = result.data[1:]
+            result.dim = [_dimData(item.dim[0], time[1:])]
+            result.time = result.dim[0].data
+
+        if len(time) > 0:
+            last = (time[-1], data[-1])
+            total = result.data[-1] if len(result.data) > 0 else total
+        yield result
+
+
+def _dimData(dim, data):
+    newdim = XPadDataDim(dim)
+    newdim.data = data
+    return newdim
+
+
+def _withData(item, time, data):
+    newitem = XPadDataItem(item)
+    newitem.data = data
+    newitem.dim = [_dimData(item.dim[0], time)]
+    return newitem
@@ -11,6 +11,9 @@
 #   old version (create_dimension, create_variable)
 #   new version (createDimension, createVariable)
 #
+# Memory-mapped reading of NetCDF3 (classic) files uses
+# scipy.io.netcdf_file, whichever library is used otherwise
+#
 
 try:
     import numpy as np
@@ -39,9 +42,380 @@ except ImportError:
         except:
             print("No supported NetCDF modules available")
             raise
+
+try:
+    from scipy.io import netcdf_file as MmapDataset
+except ImportError:
+    MmapDataset = None
+
+import os
+import threading
 import time
+import warnings
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+from .pyxpad_utils import XPadDataItem, XPadDataDim, XPadDataInfo, XPadVarInfo, slotState
+
+
+# netCDF-C and HDF5 are not thread safe even when using different
+# files, so all netCDF4 datasets share one lock
+libraryLock = threading.RLock()
+
+
+class PooledHandle:
+    """
+    An open file in a HandlePool
+
+    dataset   The open Dataset
+    lock      Must be held while using the dataset, since the
+              NetCDF libraries are not thread safe. For netCDF4
+              this is libraryLock, shared by all files
+    mmap      If True, the file is memory-mapped with scipy, and
+              arrays read refer directly to the file
+    """
+
+    def __init__(self, filename, mmap=False):
+        self.filename = filename
+        self.mmap = mmap
+        self.mtime = os.path.getmtime(filename)
+        self.lock = self.newLock(mmap)
+        with self.lock:
+            self.dataset = self.open(filename, mmap)
+        self.users = 0          # Number of acquire() without release()
+        self.lastused = time.time()
+        self.stale = False      # File changed, so close when released
+
+    def newLock(self, mmap=False):
+        """The lock to hold while using the dataset"""
+        if library == "netCDF4" and not mmap:
+            return libraryLock
+        return threading.RLock()
+
+    def open(self, filename, mmap=False):
+        """Open the file, returning the dataset"""
+        if mmap:
+            if MmapDataset is None:
+                raise ImportError("Memory mapping needs scipy.io.netcdf_file")
+            return MmapDataset(filename, "r", mmap=True)
+        return Dataset(filename, "r")
+
+    def close(self):
+        with warnings.catch_warnings():
+            # Memory-mapped arrays still in use keep the file mapped,
+            # which scipy warns about
+            warnings.simplefilter("ignore", RuntimeWarning)
+            with self.lock:
+                self.dataset.close()
+
+
+class HandlePool:
+    """
+    A bounded pool of open files, shared between sources
+
+    Keeps up to maxopen files open, closing the least recently used
+    when more are needed. Files not used for timeout seconds are
+    closed, and a file is reopened if its modification time changes.
+
+    Files are never opened or closed while holding the pool's lock,
+    since that takes the handle's lock, which readers hold while
+    acquiring other files.
+
+    Usage:
+
+      with handles.dataset(filename) as f:
+          data = f.variables[name][:]
+
+    """
+
+    handleClass = PooledHandle  # Opens files. Called as handleClass(filename, mmap=mmap)
+
+    def __init__(self, maxopen=32, timeout=60.):
+        self.maxopen = maxopen
+        self.timeout = timeout
+        self._handles = OrderedDict()  # filename -> PooledHandle, oldest first
+        self._lock = threading.Lock()
+        self._janitor = None
+
+    def acquire(self, filename, mmap=False):
+        """
+        Returns an open PooledHandle for filename. Must be paired
+        with a call to release()
+        """
+        filename = os.path.abspath(filename)
+        mtime = os.path.getmtime(filename)
+        key = (filename, mmap)
+        toclose = []
+        new = None
+        try:
+            while True:
+                with self._lock:
+                    h = self._handles.get(key)
+                    if h is not None and h.mtime != mtime:
+                        # File has changed since opened
+                        toclose += self._discard(h)
+                        h = None
+                    if h is None and new is not None:
+                        h, new = new, None
+                        self._handles[key] = h
+                    if h is not None:
+                        self._handles.move_to_end(key)
+                        h.users += 1
+                        h.lastused = time.time()
+                        toclose += self._shrink()
+                        break
+                # Open outside the lock, then check again in
+                # case another thread opened the file meanwhile
+                new = self.handleClass(filename, mmap=mmap)
+        finally:
+            if new is not None:
+                toclose.append(new)
+            self._close(toclose)
+        self._startJanitor()
+        return h
 
-from .pyxpad_utils import XPadDataItem, XPadDataDim
+    def release(self, h):
+        with self._lock:
+            h.users -= 1
+            h.lastused = time.time()
+            toclose = [h] if h.stale and h.users == 0 else []
+        self._close(toclose)
+
+    @contextmanager
+    def dataset(self, filename, mmap=False):
+        """
+        Context manager giving exclusive use of an open Dataset
+        """
+        h = self.acquire(filename, mmap=mmap)
+        try:
+            with h.lock:
+                yield h.dataset
+        finally:
+            self.release(h)
+
+    def closeIdle(self, timeout=None):
+        """
+        Close all files not used in the last timeout seconds
+        """
+        if timeout is None:
+            timeout = self.timeout
+        now = time.time()
+        toclose = []
+        with self._lock:
+            for h in list(self._handles.values()):
+                if h.users == 0 and now - h.lastused >= timeout:
+                    toclose += self._discard(h)
+            nopen = len(self._handles)
+        self._close(toclose)
+        return nopen
+
+    def closeAll(self):
+        self.closeIdle(timeout=0)
+
+    def _discard(self, h):
+        """
+        Remove from the pool. Returns a list of the handles to
+        close, which is empty if h is in use, since it is then
+        closed when released. Must be called with self._lock held
+        """
+        del self._handles[(h.filename, h.mmap)]
+        if h.users == 0:
+            return [h]
+        h.stale = True
+        return []
+
+    def _shrink(self):
+        """
+        Remove least recently used files until no more than maxopen.
+        Returns a list of the handles to close.
+        Must be called with self._lock held
+        """
+        toclose = []
+        excess = len(self._handles) - self.maxopen
+        for h in list(self._handles.values()):
+            if excess <= 0:
+                break
+            if h.users == 0:
+                toclose += self._discard(h)
+                excess -= 1
+        return toclose
+
+    @staticmethod
+    def _close(toclose):
+        """Close handles removed from the pool, without self._lock held"""
+        for h in toclose:
+            h.close()
+
+    def _startJanitor(self):
+        """
+        Start a thread to close idle files, if not already running
+        """
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(target=self._runJanitor,
+                                             name="NetCDF handle janitor")
+            self._janitor.daemon = True
+            self._janitor.start()
+
+    def _runJanitor(self):
+        while True:
+            time.sleep(max(self.timeout / 2., 1.))
+            with self._lock:
+                if len(self._handles) == 0:
+                    # Nothing left to close. Restarted by acquire()
+                    self._janitor = None
+                    return
+            self.closeIdle()
+
+
+# Open files shared between all NetCDFDataSource objects
+handles = HandlePool()
+
+
+def dimlen(handle, dimname):
+    """Length of a dimension in an open file."""
+    dim = handle.dimensions[dimname]
+    if dim is None:
+        # Unlimited dimension in scipy.io.netcdf
+        for var in handle.variables.values():
+            if var.dimensions and var.dimensions[0] == dimname:
+                return var.shape[0]
+        return 0
+    t = type(dim).__name__
+    if t == 'int':
+        return dim
+    return len(dim)
+
+
+def vartype(var):
+    """NumPy dtype of a variable in an open file, without reading it."""
+    dtype = getattr(var, "dtype", None)
+    if dtype is not None:
+        return dtype
+    try:
+        return np.dtype(var.typecode())
+    except Exception:
+        return None
+
+
+def findVariable(handle, name):
+    """
+    Find a variable in an open file, falling back to
+    a case-insensitive search. Returns None if not found
+    """
+    try:
+        return handle.variables[name]
+    except KeyError:
+        pass
+    for n in handle.variables.keys():
+        if n.lower() == name.lower():
+            print("WARNING: Reading '"+n+"' instead of '"+name+"'")
+            return handle.variables[n]
+    return None
+
+
+class NetCDFDim(XPadDataDim):
+    """
+    A dimension in a NetCDF file, whose data is read when first used
+
+    The values are taken from the coordinate variable with the same
+    name as the dimension if there is one, otherwise they are the
+    indices 0 to n-1. Each read of the file calls check(), so that
+    they are read again if the file has changed.
+    """
+
+    __slots__ = ("_data", "_mtime", "filename")
+
+    def __init__(self, filename, name):
+        self._data = None
+        self._mtime = None
+        XPadDataDim.__init__(self)
+        self.filename = filename
+        self.name = name
+        self.label = name
+
+    @property
+    def data(self):
+        if self._data is None:
+            with handles.dataset(self.filename) as handle:
+                return self.read(handle)
+        return self._data
+
+    def read(self, handle):
+        """
+        The values, read using handle, an open dataset for the file,
+        if not already read. Readers holding a handle use this, rather
+        than data, so the file isn't acquired again
+        """
+        if self._data is None:
+            mtime = os.path.getmtime(self.filename)
+            coord = handle.variables.get(self.name)
+            if coord is not None and tuple(coord.dimensions) == (self.name,):
+                values = np.array(coord[:])
+            else:
+                values = np.arange(dimlen(handle, self.name))
+            self._data, self._mtime = values, mtime
+        return self._data
+
+    @data.setter
+    def data(self, values):
+        self._data = values
+        self._mtime = None if values is None else os.path.getmtime(self.filename)
+
+    def check(self, mtime):
+        """
+        Forget the values if they were read from an older version of
+        the file. mtime is the file's modification time, or None if
+        it's gone, in which case the values are kept
+        """
+        if mtime is not None and mtime != self._mtime:
+            self._data = None
+
+    def part(self, values):
+        """
+        A plain XPadDataDim with the same name, label and units,
+        but the given values, so this dimension's data isn't read
+        """
+        dim = XPadDataDim()
+        dim.name, dim.label, dim.units = self.name, self.label, self.units
+        dim.data = values
+        return dim
+
+    def __getstate__(self):
+        # Read again when needed
+        state = slotState(self)
+        state['_data'] = None
+        state['_mtime'] = None
+        return state
+
+
+class NetCDFVariables(Mapping):
+    """
+    Dictionary of XPadVarInfo objects, one for each
+    variable in a NetCDFDataSource, each created when first looked up.
+    Items share the source's dimensions.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._items = {}
+
+    def __getitem__(self, name):
+        item = self._items.get(name)
+        if item is None:
+            dimnames = self.source._vardims[name]
+            item = XPadVarInfo(name, self.source.filename,
+                               dim=[self.source.dimensions[d] for d in dimnames])
+            self._items[name] = item
+        return item
+
+    def __iter__(self):
+        return iter(self.source._vardims)
+
+    def __len__(self):
+        return len(self.source._vardims)
 
 
 class NetCDFDataSource:
@@ -51,6 +425,15 @@ class NetCDFDataSource:
       read( name , shot)   Input variable name (string)
                            Output is an XPadDataItem object or None
 
+      readMany( names, shot )  Read several variables at once.
+                               Output is a list of XPadDataItem or None
+
+      blocks( name )  Read a variable in blocks along its first dimension.
+                      Output is a generator of XPadDataItem objects
+
+      probe( name )  Size and type of a variable, without reading it.
+                     Output is an XPadDataInfo object or None
+
       size( name )   Returns variable size as a list. [] for scalar
 
     Attributes
@@ -58,113 +441,294 @@ class NetCDFDataSource:
       label         A short string to describe the source
       dimensions    A dictionary of XPadDataDim objects
       varNames      A list of variable names
-      variables     A dictionary of XPadDataItem objects with empty data
+      variables     A dictionary of XPadVarInfo objects
+
+    Files are opened through the shared HandlePool "handles", so
+    repeated reads do not re-open the file.
+
+    If mmap is True (config 'Memory map'), NetCDF3 files are memory
+    mapped: data items returned by read() are read-only views of
+    the file, loaded from disk only when used. The file must not be
+    modified in place while these are in use.
+
+    Dimensions and variables are only read from the file when used.
 
     """
     handle = None
+    _variables = None
 
     def open(self, fname=None):
         if fname is None:
             fname = self.filename
-        self.handle = Dataset(fname, "r")
+        self.close()
+        self._pooled = handles.acquire(fname)
+        self.handle = self._pooled.dataset
 
     def close(self):
         if self.handle is not None:
-            self.handle.close()
+            handles.release(self._pooled)
+            del self._pooled
         self.handle = None
 
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=False):
         self.filename = filename
         self.label = filename   # May need to shorten
-        self.open(filename)
-        self.dimensions = self.getDimensions()        # A dictionary of XPadDataDim objects
-        self.varNames = list(self.handle.variables.keys())  # A list of variable names
-        for i, v in enumerate(self.varNames):
+        self.config = {'Memory map': bool(mmap),
+                       'Block size': 1048576}
+        if mmap:
             try:
-                # Python 2
-                if isinstance(v, unicode):
-                    v = v.encode('utf-8')
-                v = str(v).translate(None, '\0')
-            except NameError:
-                pass
-
-            self.varNames[i] = v
-
-        self.variables = {}   # A dictionary of XPadDataItem objects with empty data
-        for name, var in self.handle.variables.items():
-            item = XPadDataItem()
-            item.name   = name
-            item.source = self.filename
-            item.dim = [self.dimensions[d] for d in var.dimensions]
-            self.variables[name] = item
-        self.close()
+                handles.release(handles.acquire(filename, mmap=True))
+            except Exception as e:
+                print("WARNING: Cannot memory map '{}': {}".format(filename, e))
+                self.config['Memory map'] = False
+
+        with handles.dataset(filename) as handle:
+            self.dimensions = self.getDimensions(handle)   # A dictionary of XPadDataDim objects
+            self.varNames = list(handle.variables.keys())  # A list of variable names
+            for i, v in enumerate(self.varNames):
+                try:
+                    # Python 2
+                    if isinstance(v, unicode):
+                        v = v.encode('utf-8')
+                    v = str(v).translate(None, '\0')
+                except NameError:
+                    pass
+
+                self.varNames[i] = v
+
+            # Dimension names of each variable
+            self._vardims = {name: tuple(var.dimensions)
+                             for name, var in handle.variables.items()}
+
+    @property
+    def variables(self):
+        """A dictionary of XPadVarInfo objects"""
+        if self._variables is None:
+            self._variables = NetCDFVariables(self)
+        return self._variables
 
     def __del__(self):
         self.close()
 
-    def read(self, name, shot):
-        """Read a variable from the file."""
-        self.open()
-        if self.handle is None:
-            return None
+    def __getstate__(self):
+        # Open files can't be pickled
+        state = self.__dict__.copy()
+        for name in ['handle', '_pooled', '_variables']:
+            if name in state:
+                del state[name]
+        return state
 
-        try:
-            var = self.handle.variables[name]
-        except KeyError:
-            # Not found. Try to find using case-insensitive search
-            var = None
-            for n in self.handle.variables.keys():
-                if n.lower() == name.lower():
-                    print("WARNING: Reading '"+n+"' instead of '"+name+"'")
-                    var = self.handle.variables[n]
-            if var is None:
-                return None
+    def __setstate__(self, state):
+        if '_vardims' not in state:
+            # Saved before dimensions and variables were read lazily
+            variables = state.pop('variables', {})
+            state['_vardims'] = {name: tuple(d.name for d in item.dim)
+                                 for name, item in variables.items()}
+            state['dimensions'] = {name: NetCDFDim(state['filename'], name)
+                                   for name in state.get('dimensions') or {}}
+        self.__dict__.update(state)
+
+    def readKey(self, name, shot):
+        """
+        Identifies the data read, so that identical reads
+        of the same version of the file can be shared
+        """
+        filename = os.path.abspath(self.filename)
+        return (filename, os.path.getmtime(filename), name,
+                getattr(self, 'config', {}).get('Memory map', False))
+
+    def read(self, name, shot, trange=None, npoints=None):
+        """Read a variable from the file.
+
+        trange    Optional (min, max) range of the first dimension to read.
+                  Uses the coordinate variable with the same name as the
+                  dimension if there is one, otherwise the index
+        npoints   Optional maximum number of points along the first
+                  dimension. The data is strided to fit
+
+        Only the selected part of the variable is read from disk
+        """
+        return self.readMany([name], shot, trange=trange, npoints=npoints)[0]
+
+    def readMany(self, names, shot, trange=None, npoints=None):
+        """Read a list of variables, opening the file only once.
+
+        Returns a list of XPadDataItem objects, with None for
+        any variables which were not found. See read() for arguments
+        """
+        mmap = getattr(self, 'config', {}).get('Memory map', False)
+        self.checkDimensions()
+        with handles.dataset(self.filename, mmap=mmap) as handle:
+            return [self._read(handle, name, trange, npoints, mmap) for name in names]
+
+    def _read(self, handle, name, trange, npoints, mmap=False):
+        var = findVariable(handle, name)
+        if var is None:
+            return None
         ndims = len(var.dimensions)
+        dims = [self.dimensions[d] for d in var.dimensions]
         if ndims == 0:
             data = var.getValue()
-        else:
+        elif trange is None and npoints is None:
             data = var[:]
+        else:
+            index, dims[0] = self.window(handle, var.dimensions[0], trange, npoints)
+            data = var[index]
+        return self._item(name, data, dims, mmap)
+
+    def _item(self, name, data, dims, mmap=False):
+        if mmap:
+            # View of the file, which must not be changed
+            data = np.asarray(data).view()
+            data.flags.writeable = False
+        elif library == "scipy":
+            # Arrays refer to the file, which the pool may close
+            data = np.array(data)
         item = XPadDataItem()
         item.name   = name
         item.source = self.filename
         item.data   = data
-        item.dim = [self.dimensions[d] for d in var.dimensions]
-
-        self.close()
+        item.dim = dims
         return item
 
-    def getDimensions(self):
-        if self.handle is None:
+    def blocks(self, name, shot="", blocksize=None, overlap=0, trange=None):
+        """Read a variable in blocks along its first dimension.
+
+        A generator of XPadDataItem objects, each with up to blocksize
+        points of the first dimension, so that variables larger than
+        memory can be processed a piece at a time.
+
+        blocksize  Number of points in each block. Default is
+                   config 'Block size'
+        overlap    Number of points each block repeats from the
+                   end of the one before
+        trange     Optional (min, max) range of the first dimension
+
+        The file is kept open until the generator is finished or
+        closed, but only locked while each block is read.
+        """
+        config = getattr(self, 'config', {})
+        if blocksize is None:
+            blocksize = config.get('Block size', 1048576)
+        blocksize, overlap = int(blocksize), int(overlap)
+        if overlap < 0 or blocksize <= overlap:
+            raise ValueError("Block size must be larger than the overlap")
+        mmap = config.get('Memory map', False)
+        self.checkDimensions()
+
+        h = handles.acquire(self.filename, mmap=mmap)
+        try:
+            with h.lock:
+                var = findVariable(h.dataset, name)
+                if var is None:
+                    raise KeyError("No variable '{}' in '{}'".format(name, self.filename))
+                if len(var.dimensions) == 0:
+                    block = self._read(h.dataset, name, None, None, mmap)
+                    start, stop = 0, 0
+                else:
+                    block = None
+                    dimname = var.dimensions[0]
+                    if trange is None:
+                        start, stop = 0, dimlen(h.dataset, dimname)
+                    else:
+                        index, _ = self.window(h.dataset, dimname, trange)
+                        start, stop = index.start, index.stop
+            if block is not None:
+                yield block
+                return
+
+            while start < stop:
+                end = min(start + blocksize, stop)
+                with h.lock:
+                    var = findVariable(h.dataset, name)
+                    dims = [self.dimensions[d] for d in var.dimensions]
+                    coord = h.dataset.variables.get(dimname)
+                    if coord is not None and tuple(coord.dimensions) == (dimname,):
+                        values = np.array(coord[start:end])
+                    else:
+                        values = np.arange(start, end)
+                    dims[0] = dims[0].part(values)
+                    block = self._item(name, var[start:end], dims, mmap)
+                yield block
+                if end == stop:
+                    break
+                start = end - overlap
+        finally:
+            handles.release(h)
+
+    def window(self, handle, dimname, trange=None, npoints=None):
+        """
+        Find the part of a dimension to read
+
+        Returns a (slice, XPadDataDim) pair, the slice selecting the
+        points of the dimension within trange, strided so there are
+        no more than npoints.
+        """
+        values = self.dimensions[dimname].read(handle)
+        n = len(values)
+
+        start, stop = 0, n
+        if trange is not None:
+            tmin, tmax = trange
+            start = int(np.searchsorted(values, tmin, side='left'))
+            stop = int(np.searchsorted(values, tmax, side='right'))
+            if stop <= start:
+                raise ValueError("No data in range {} to {} of '{}'"
+                                 .format(tmin, tmax, dimname))
+        step = 1
+        if npoints is not None and npoints > 0 and stop - start > npoints:
+            step = int(np.ceil((stop - start) / float(npoints)))
+        index = slice(start, stop, step)
+
+        return index, self.dimensions[dimname].part(values[index])
+
+    def checkDimensions(self):
+        """
+        Check the file's modification time once before a read, so
+        that dimensions are read again only if the file has changed
+        """
+        try:
+            mtime = os.path.getmtime(self.filename)
+        except OSError:
+            mtime = None
+        for dim in (self.dimensions or {}).values():
+            if isinstance(dim, NetCDFDim):
+                dim.check(mtime)
+
+    def getDimensions(self, handle=None):
+        """Dictionary of NetCDFDim objects, whose data is read when used."""
+        if handle is None:
+            handle = self.handle
+        if handle is None:
             return None
-        dims = {}
-        for name, dim in self.handle.dimensions.items():
-            t = type(dim).__name__
-            if t == 'int':
-                n = dim
-            else:
-                n = len(dim)
-            newdim = XPadDataDim()
-            newdim.name = name
-            newdim.label = name
-            newdim.data  = np.arange(n)
-            dims[name] = newdim
-        return dims
+        return {name: NetCDFDim(self.filename, name)
+                for name in handle.dimensions.keys()}
+
+    def probe(self, name, shot=""):
+        """Size and type of a variable, without reading its data.
+
+        Returns an XPadDataInfo, or None if the variable is not found.
+        The time range is from the first and last values of the
+        coordinate variable for the first dimension, if there is one.
+        """
+        with handles.dataset(self.filename) as handle:
+            var = findVariable(handle, name)
+            if var is None:
+                return None
+            shape = [dimlen(handle, d) for d in var.dimensions]
+            trange = None
+            if shape and shape[0] > 0:
+                dimname = var.dimensions[0]
+                coord = handle.variables.get(dimname)
+                if coord is not None and tuple(coord.dimensions) == (dimname,):
+                    trange = (coord[0], coord[shape[0] - 1])
+                else:
+                    trange = (0, shape[0] - 1)
+            return XPadDataInfo(shape, vartype(var), trange)
 
     def size(self, varname):
         """List of dimension sizes for a variable."""
-        if self.handle is None:
+        info = self.probe(varname)
+        if info is None:
             return []
-        try:
-            var = self.handle.variables[varname]
-        except KeyError:
-            return []
-
-        def dimlen(d):
-            dim = self.handle.dimensions[d]
-            if dim is not None:
-                t = type(dim).__name__
-                if t == 'int':
-                    return dim
-                return len(dim)
-            return 0
-        return [dimlen(d) for d in var.dimensions]
+        return list(info.shape)
@@ -0,0 +1,224 @@
+"""
+A stand-in for the UDA/IDAM client, for testing without a server
+
+Client provides the same get(name, shot) as the UDA client used by
+XPadSource. Signals are replayed from recordings made with
+RecordingClient, or made up. Latency, bandwidth and failures can
+be set to mimic a real server, so that concurrency, caching and
+timeouts can be measured and tested offline.
+
+Usage:
+
+  >>> from pyxpad import fakeuda
+  >>> from pyxpad.xpadsource import XPadSource
+  >>> source = XPadSource("/path/to/xpad/tree")
+  >>> fakeuda.install(source, latency=0.2, bandwidth=10e6, failureRate=0.1)
+  >>> item = source.read("amc_plasma current", 29000)
+  >>> fakeuda.Client.stats
+  {'gets': 1, 'bytes': 800000, 'failures': 0}
+
+To record signals from a real server for later replay:
+
+  >>> fakeuda.record(source, "/path/to/recordings")
+
+and then replay them with
+
+  >>> fakeuda.install(source, recordings="/path/to/recordings")
+
+"""
+
+import hashlib
+import random
+import threading
+import time
+import types
+
+import numpy as np
+
+from .cache import SignalCache
+from .pyxpad_utils import XPadDataItem, XPadDataDim, subset
+
+
+class Client:
+    """
+    Stand-in UDA client
+
+    Settings are class attributes, shared by all clients:
+
+    server, port   Set before creating a client, as for the UDA client
+    latency        Seconds before each get() returns
+    bandwidth      Bytes per second for the data, or None for no limit
+    failureRate    Fraction of get() calls which raise failure
+    failure        Exception class raised on failure
+    hangRate       Fraction of get() calls which take hangTime seconds
+    hangTime       Seconds a hanging get() takes
+    recordings     Directory of recorded signals, or None
+    npoints        Number of points in made-up signals
+    lastshot       Shot number returned for "lastshot"
+    seed           Seed for failures and hangs, for repeatable tests
+    stats          Counts of gets, bytes and failures
+    """
+
+    server = "localhost"
+    port = 56565
+
+    latency = 0.0
+    bandwidth = None
+    failureRate = 0.0
+    failure = ConnectionError
+    hangRate = 0.0
+    hangTime = 3600.
+    recordings = None
+    npoints = 100000
+    lastshot = 30000
+    seed = None
+
+    canSubset = True  # get() accepts trange and npoints
+
+    stats = {'gets': 0, 'bytes': 0, 'failures': 0}
+    _lock = threading.Lock()
+    _random = random.Random()
+
+    def __init__(self):
+        self.server = Client.server
+        self.port = Client.port
+
+    def get(self, name, shot, trange=None, npoints=None):
+        with self._lock:
+            self.stats['gets'] += 1
+            fail = self._random.random() < self.failureRate
+            hang = self._random.random() < self.hangRate
+            if fail:
+                self.stats['failures'] += 1
+
+        time.sleep(self.latency)
+        if hang:
+            time.sleep(self.hangTime)
+        if fail:
+            raise self.failure("Injected failure reading '{}' shot {}".format(name, shot))
+
+        name = str(name).strip()
+        shot = str(shot).strip()
+
+        if name == "lastshot":
+            # Mimic the structure returned by the UDA server
+            lastshot = types.SimpleNamespace(lastshot=self.lastshot)
+            return types.SimpleNamespace(data=types.SimpleNamespace(children=[lastshot]),
+                                         name=name, label=name, dims=[])
+
+        item = None
+        if self.recordings is not None:
+            item = recordings(self.recordings).get((name, shot))
+        if item is None:
+            item = synthetic(name, shot, self.npoints)
+        item = subset(item, trange, npoints)
+
+        nbytes = getattr(item.data, "nbytes", 0)
+        with self._lock:
+            self.stats['bytes'] += nbytes
+        if self.bandwidth:
+            time.sleep(nbytes / float(self.bandwidth))
+        return item
+
+
+def synthetic(name, shot, npoints):
+    """
+    A made-up signal, the same every time for the same name and shot
+    """
+    seed = int(hashlib.md5("{}/{}".format(name, shot).encode('utf-8')).hexdigest()[:8], 16)
+    rng = np.random.RandomState(seed)
+
+    time = XPadDataDim()
+    time.name = time.label = "Time"
+    time.units = "s"
+    time.data = np.linspace(0.0, 1.0, npoints)
+
+    item = XPadDataItem()
+    item.name = name
+    item.label = name
+    item.source = "Shot " + shot
+    item.data = (np.sin(2. * np.pi * rng.uniform(1., 100.) * time.data) +
+                 0.1 * rng.standard_normal(npoints))
+    item.dim = [time]
+    item.order = 0
+    item.time = time.data
+    return item
+
+
+_recordings = {}
+
+
+def recordings(path):
+    """
+    SignalCache of recorded signals in directory path
+    """
+    if path not in _recordings:
+        _recordings[path] = SignalCache(path, maxsize=float('inf'))
+    return _recordings[path]
+
+
+class RecordingClient:
+    """
+    Wraps a client, recording each signal read into a directory
+    for replay by Client
+    """
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def get(self, name, shot):
+        data = self.client.get(name, shot)
+        if hasattr(data, "dims") and not hasattr(data, "dim"):
+            data.dim = data.dims
+        try:
+            item = XPadDataItem(data)
+        except Exception:
+            return data  # Not a signal, e.g. "lastshot"
+        recordings(self.path).put((str(name).strip(), str(shot).strip()), item)
+        return data
+
+
+def install(source, **settings):
+    """
+    Make an XPadSource tree use the stand-in Client.
+    Keyword arguments set Client's settings, e.g. latency=0.5
+    """
+    for name, value in settings.items():
+        if not hasattr(Client, name):
+            raise AttributeError("Client has no setting '{}'".format(name))
+        setattr(Client, name, value)
+    if 'seed' in settings:
+        Client._random.seed(settings['seed'])
+    pool = source.clientPool()
+    pool.clear()
+    pool.clientClass = Client
+
+
+def resetStats():
+    with Client._lock:
+        Client.stats = {'gets': 0, 'bytes': 0, 'failures': 0}
+
+
+def record(source, path):
+    """
+    Make an XPadSource tree record all signals it reads from
+    the server into directory path
+    """
+    pool = source.clientPool()
+    clientClass = pool.clientClass
+    if clientClass is None:
+        from .xpadsource import idam
+        clientClass = idam.Client
+
+    class Recorder:
+        # Set by ClientPool before creating each client
+        server = None
+        port = None
+
+        def __new__(cls):
+            clientClass.server, clientClass.port = cls.server, cls.port
+            return RecordingClient(clientClass(), path)
+
+    pool.clear()
+    pool.clientClass = Recorder
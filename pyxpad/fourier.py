@@ -2,7 +2,7 @@
 Fourier transform based methods on XPadDataItem objects
 """
 
-from .pyxpad_utils import XPadDataItem, XPadDataDim
+from .pyxpad_utils import XPadDataItem, XPadDataDim, UniformDim, isUniform
 
 from numpy.fft import rfft, rfftfreq
 from numpy import abs, arctan2, array, pi, zeros
@@ -34,7 +34,10 @@ def fftp(item):
 
     dim.name = "Frequency"
 
-    step = (item.dim[0].data[1] - item.dim[0].data[0])
+    if isUniform(item.dim[0]):
+        step = item.dim[0].step
+    else:
+        step = (item.dim[0].data[1] - item.dim[0].data[0])
     dim.data = rfftfreq(len(item.data), step)
 
     dim.units = "1/"+item.dim[0].units
@@ -92,7 +95,9 @@ def runfft(item, stride, width):
     time = item.dim[item.order]
 
     # Create dimensions
-    time_dim = XPadDataDim(time)
+    time_dim = XPadDataDim()
+    # Not copied with XPadDataDim(time), which would make uniform time values
+    time_dim.name, time_dim.label, time_dim.units = time.name, time.label, time.units
     time_dim.data = []
 
     freq_dim = XPadDataDim()
@@ -104,12 +109,17 @@ def runfft(item, stride, width):
 
     # Assume time dimension is uniformly spaced
     # Explicit assumption of FFTW
-    dt = time.data[1] - time.data[0]
+    if isUniform(time):
+        dt = time.step
+    else:
+        dt = time.data[1] - time.data[0]
     # Width and stride of window in index-space
     index_width = int(width / dt)
     index_stride = int(stride / dt)
 
-    time_len = ((len(time.data) - index_width) // index_stride) + 1
+    # Length without making the values of a uniform dimension
+    ntime = time.length if isUniform(time) else len(time.data)
+    time_len = ((ntime - index_width) // index_stride) + 1
     freq_len = (index_width // 2) + 1
 
     # Create result XPadDataItems for:
@@ -131,14 +141,25 @@ def runfft(item, stride, width):
         window_freq /= 1000.
     freq_dim.data = window_freq
 
-    for window_index, time_index in enumerate(range(0, len(time.data) - index_width, index_stride)):
+    if isUniform(time):
+        windows = range(0, time.length - index_width, index_stride)
+        # Window centres are also uniformly spaced
+        time_dim = UniformDim(time.start + 0.5*dt*(index_width - 1), dt*index_stride,
+                              len(windows), other=time)
+        amp.dim[1] = time_dim
+        amp.time = time_dim
+    else:
+        windows = range(0, ntime - index_width, index_stride)
+
+    for window_index, time_index in enumerate(windows):
         window_data = item.data[time_index:time_index + index_width]
-        window_time = time.data[time_index:time_index + index_width]
 
         window_fft = rfft(window_data) / index_width
         amp.data[:, window_index]  = abs(window_fft)
 
-        # Update time
-        time_dim.data.append((window_time[0] + window_time[-1])/2.)
+        if not isUniform(time):
+            # Update time
+            window_time = time.data[time_index:time_index + index_width]
+            time_dim.data.append((window_time[0] + window_time[-1])/2.)
 
     return amp
@@ -0,0 +1,369 @@
+"""
+Data source for HDF5 files, using h5py
+
+Every dataset in the file is a variable, named by its path within
+the file (e.g. "magnetics/ip"). Dimension scales attached to a
+dataset are used as its dimensions.
+
+"""
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+from .datafile import HandlePool, PooledHandle
+from .pyxpad_utils import XPadDataItem, XPadDataDim, XPadDataInfo, XPadVarInfo, slotState
+
+
+class HDF5Handle(PooledHandle):
+    """
+    An open HDF5 file in a HandlePool
+
+    chunkCache   Bytes of decompressed chunks kept for each open
+                 dataset, so strided reads don't decompress the
+                 same chunk repeatedly
+    """
+
+    chunkCache = 64 * 1024 * 1024
+
+    def open(self, filename, mmap=False):
+        if h5py is None:
+            raise ImportError("Reading HDF5 files needs h5py")
+        return h5py.File(filename, "r", rdcc_nbytes=self.chunkCache)
+
+    def close(self):
+        with self.lock:
+            self.dataset.close()
+
+
+class HDF5HandlePool(HandlePool):
+    handleClass = HDF5Handle
+
+
+# Open files shared between all HDF5DataSource objects
+handles = HDF5HandlePool()
+
+
+class HDF5Dim(XPadDataDim):
+    """
+    A dimension of an HDF5 dataset, whose data is read when first used
+
+    The values are taken from the dimension scale dataset at path
+    scale if there is one, otherwise they are the indices 0 to n-1.
+    """
+
+    __slots__ = ("_data", "filename", "length", "scale")
+
+    def __init__(self, filename, name, length, scale=None):
+        self._data = None
+        XPadDataDim.__init__(self)
+        self.filename = filename
+        self.name = name
+        self.label = name
+        self.length = length
+        self.scale = scale
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.scale is None:
+                self._data = np.arange(self.length)
+            else:
+                with handles.dataset(self.filename) as f:
+                    return self.read(f)
+        return self._data
+
+    def read(self, f):
+        """
+        The values, read using f, the open file, if not already read.
+        Readers holding the file use this, so it isn't acquired again
+        """
+        if self._data is None:
+            if self.scale is None:
+                self._data = np.arange(self.length)
+            else:
+                self._data = f[self.scale][()]
+        return self._data
+
+    @data.setter
+    def data(self, values):
+        self._data = values
+
+    def part(self, values):
+        """
+        A plain XPadDataDim with the same name, label and units,
+        but the given values, so this dimension's data isn't read
+        """
+        dim = XPadDataDim()
+        dim.name, dim.label, dim.units = self.name, self.label, self.units
+        dim.data = values
+        return dim
+
+    def __getstate__(self):
+        # Read again when needed
+        state = slotState(self)
+        state['_data'] = None
+        return state
+
+
+class HDF5Variables(Mapping):
+    """
+    Dictionary of XPadVarInfo objects, one for each
+    dataset in an HDF5DataSource, each created when first looked up
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._items = {}
+
+    def __getitem__(self, name):
+        item = self._items.get(name)
+        if item is None:
+            meta = self.source.metadata()[name]
+            item = XPadVarInfo(name, self.source.filename,
+                               units=meta['units'], desc=meta['desc'],
+                               dim=self.source.getDimensions(name))
+            self._items[name] = item
+        return item
+
+    def __iter__(self):
+        return iter(self.source.metadata())
+
+    def __len__(self):
+        return len(self.source.metadata())
+
+
+def attribute(obj, name, default=""):
+    """String attribute of an HDF5 object, or default if not set"""
+    value = obj.attrs.get(name, default)
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return str(value)
+
+
+class HDF5DataSource:
+    """
+
+    Functions
+      read( name, shot )   Input dataset path (string)
+                           Output is an XPadDataItem object or None
+
+      probe( name )  Size and type of a dataset, without reading it.
+                     Output is an XPadDataInfo object or None
+
+      size( name )   Returns dataset size as a list. [] for scalar
+
+    Attributes
+
+      label         A short string to describe the source
+      varNames      A list of dataset paths
+      variables     A dictionary of XPadVarInfo objects
+
+    The file's structure is only read when first needed, and
+    files are opened through the shared HandlePool "handles".
+
+    Reads of part of a dataset (trange or npoints) follow its chunk
+    layout: where most chunks are needed, whole chunks are read and
+    strided in memory, so each chunk is decompressed only once.
+    """
+
+    blockSize = 16 * 1024 * 1024  # Bytes read at once by readStrided
+
+    _meta = None
+    _variables = None
+    _dims = None
+
+    def __init__(self, filename):
+        if h5py is None:
+            raise ImportError("Reading HDF5 files needs h5py")
+        self.filename = filename
+        self.label = filename
+        self.config = {}
+        # Check that the file can be read
+        handles.release(handles.acquire(filename))
+
+    def metadata(self):
+        """
+        Dictionary of dataset path -> dictionary of shape, dtype,
+        chunks, units and desc. Read from the file when first used
+        """
+        if self._meta is None:
+            meta = {}
+
+            def visit(path, obj):
+                if isinstance(obj, h5py.Dataset):
+                    meta[path] = {'shape': obj.shape,
+                                  'dtype': obj.dtype,
+                                  'chunks': obj.chunks,
+                                  'units': attribute(obj, 'units'),
+                                  'desc': attribute(obj, 'long_name')}
+
+            with handles.dataset(self.filename) as f:
+                f.visititems(visit)
+            self._meta = meta
+        return self._meta
+
+    @property
+    def varNames(self):
+        return list(self.metadata().keys())
+
+    @property
+    def variables(self):
+        """A dictionary of XPadVarInfo objects"""
+        if self._variables is None:
+            self._variables = HDF5Variables(self)
+        return self._variables
+
+    def getDimensions(self, name):
+        """
+        List of HDF5Dim objects for a dataset, shared between
+        datasets using the same dimension scale
+        """
+        if self._dims is None:
+            self._dims = {}
+        shape = self.metadata()[name]['shape']
+        dims = []
+        with handles.dataset(self.filename) as f:
+            dset = f[name]
+            for i, length in enumerate(shape):
+                scale = None
+                dimname = dset.dims[i].label or "dim{}".format(i)
+                if len(dset.dims[i]) > 0:
+                    scale = dset.dims[i][0].name
+                    dimname = dset.dims[i].label or scale.split("/")[-1]
+                key = (scale, length) if scale is not None else (name, i)
+                if key not in self._dims:
+                    dim = HDF5Dim(self.filename, dimname, length, scale)
+                    if scale is not None:
+                        dim.units = attribute(f[scale], 'units')
+                    self._dims[key] = dim
+                dims.append(self._dims[key])
+        return dims
+
+    def __getstate__(self):
+        # Open files can't be pickled. Structure is re-read when needed
+        state = self.__dict__.copy()
+        for name in ['_meta', '_variables', '_dims']:
+            state.pop(name, None)
+        return state
+
+    def readKey(self, name, shot):
+        """
+        Identifies the data read, so that identical reads
+        of the same version of the file can be shared
+        """
+        filename = os.path.abspath(self.filename)
+        return (filename, os.path.getmtime(filename), name)
+
+    def read(self, name, shot, trange=None, npoints=None):
+        """Read a dataset from the file.
+
+        trange    Optional (min, max) range of the first dimension to read.
+                  Uses the dimension scale if there is one, otherwise the index
+        npoints   Optional maximum number of points along the first
+                  dimension. The data is strided to fit
+        """
+        if name not in self.metadata():
+            return None
+        dims = list(self.getDimensions(name))
+        meta = self.metadata()[name]
+
+        with handles.dataset(self.filename) as f:
+            dset = f[name]
+            if len(dims) == 0:
+                data = dset[()]
+            elif trange is None and npoints is None:
+                data = dset[...]
+            else:
+                index = self.window(dims[0], trange, npoints, f)
+                data = self.readStrided(dset, index, meta['chunks'])
+                dims[0] = dims[0].part(dims[0].read(f)[index])
+
+        item = XPadDataItem()
+        item.name   = name
+        item.source = self.filename
+        item.units  = meta['units']
+        item.desc   = meta['desc']
+        item.data   = data
+        item.dim    = dims
+        return item
+
+    @staticmethod
+    def window(dim, trange=None, npoints=None, f=None):
+        """
+        Slice selecting the points of a dimension within trange,
+        strided so there are no more than npoints. f is the open
+        file, if the caller holds it
+        """
+        n = dim.length
+        start, stop = 0, n
+        if trange is not None:
+            values = dim.data if f is None else dim.read(f)
+            tmin, tmax = trange
+            start = int(np.searchsorted(values, tmin, side='left'))
+            stop = int(np.searchsorted(values, tmax, side='right'))
+            if stop <= start:
+                raise ValueError("No data in range {} to {} of '{}'"
+                                 .format(tmin, tmax, dim.name))
+        step = 1
+        if npoints is not None and npoints > 0 and stop - start > npoints:
+            step = int(np.ceil((stop - start) / float(npoints)))
+        return slice(start, stop, step)
+
+    @staticmethod
+    def readStrided(dset, index, chunks):
+        """
+        Read dset[index], where index is a slice of the first dimension.
+
+        If the stride is at least the chunk length, each point selected
+        is in a different chunk, so HDF5 reads only the chunks needed.
+        Otherwise most chunks are needed, so whole chunks are read,
+        a few at a time, and strided in memory.
+        """
+        start, stop, step = index.start, index.stop, index.step
+        if step == 1 or chunks is None or step >= chunks[0]:
+            return dset[start:stop:step]
+
+        # Read blocks of whole chunks, aligned to chunk boundaries
+        rowbytes = dset.dtype.itemsize * int(np.prod(dset.shape[1:], dtype=int))
+        nchunks = max(1, HDF5DataSource.blockSize // max(1, rowbytes * chunks[0]))
+        blocklen = nchunks * chunks[0]
+        parts = []
+        pos = start
+        while pos < stop:
+            end = min(((pos // chunks[0]) * chunks[0]) + blocklen, stop)
+            block = dset[pos:end]
+            parts.append(block[::step])
+            # Next point in the stride
+            pos += len(range(pos, end, step)) * step
+        return np.concatenate(parts)
+
+    def probe(self, name, shot=""):
+        """Size and type of a dataset, without reading its data."""
+        meta = self.metadata().get(name)
+        if meta is None:
+            return None
+        trange = None
+        shape = meta['shape']
+        if shape and shape[0] > 0:
+            dim = self.getDimensions(name)[0]
+            if dim.scale is None:
+                trange = (0, shape[0] - 1)
+            else:
+                with handles.dataset(self.filename) as f:
+                    scale = f[dim.scale]
+                    trange = (scale[0], scale[shape[0] - 1])
+        return XPadDataInfo(shape, meta['dtype'], trange)
+
+    def size(self, name):
+        """List of dimension sizes for a dataset."""
+        meta = self.metadata().get(name)
+        if meta is None:
+            return []
+        return list(meta['shape'])
@@ -32,6 +32,8 @@ from Qt.QtCore import Qt
 
 import numpy as np
 
+from .pyxpad_utils import timeValues
+
 
 class MatplotlibWidget():
 
@@ -101,7 +103,7 @@ class MatplotlibWidget():
                         label = data.label
                     label += " " + data.source
 
-                    time = data.time
+                    time = timeValues(data)
                     if time is None:
                         if len(data.dim) != 1:
                             print(data.dim)
@@ -125,7 +127,7 @@ class MatplotlibWidget():
             except TypeError:
                 # p not iterable, so just plot item
                 #self.axes.plot(p.time, p.data)
-                time = p.time.data
+                time = timeValues(p)
                 xlabel = p.dim[p.order].label
                 if time is None:
                     if len(p.dim) != 1:
@@ -188,7 +190,7 @@ class MatplotlibWidget():
                     if label == "":
                         label = data.name + " (" + data.units + ") " + data.source
 
-                    time = data.time
+                    time = timeValues(data)
                     if time is None:
                         if len(data.dim) != 1:
                             print(data.dim)
@@ -207,7 +209,7 @@ class MatplotlibWidget():
                 self.axes.legend()
             except TypeError:
                 #Trace not iterable
-                time = trace.time.data
+                time = timeValues(trace)
                 xlabel = trace.dim[trace.order].label
                 if time is None:
                     if len(trace.dim) != 1:
@@ -290,7 +292,7 @@ class MatplotlibWidget():
                         label = data.name + " (" + data.units + ")"
                     label += " " + data.source
 
-                    time = data.time
+                    time = timeValues(data)
                     if time is None:
                         if len(data.dim) != 1:
                             raise ValueError("Cannot plot '"+data.name+"' as it has too many dimensions")
@@ -313,7 +315,7 @@ class MatplotlibWidget():
 
             except TypeError:
                 # Traces[plotnum] not iterable
-                time = traces[plotnum].time.data
+                time = timeValues(traces[plotnum])
                 xlabel = traces[plotnum].dim[traces[plotnum.order]].label
                 if time is None:
                     if len(traces[plotnum].dim) != 1:
@@ -427,7 +429,7 @@ class MatplotlibWidget():
                     if label == "":
                         label = data.name + " (" + data.units + ") " + data.source
 
-                    time = data.time
+                    time = timeValues(data)
                     if time is None:
                         if len(data.dim) != 1:
                             print(data.dim)
@@ -448,7 +450,7 @@ class MatplotlibWidget():
                 self.ax_bottom.legend()
             except TypeError:
                 # Trace not iterable
-                time = trace.time.data
+                time = timeValues(trace)
                 xlabel = trace.dim[trace.order].label
                 if time is None:
                     if len(trace.dim) != 1:
@@ -0,0 +1,267 @@
+"""
+Directory of NumPy .npy files as a data source
+
+Each signal is a file <name>.npy, with an optional JSON sidecar
+<name>.json describing it, e.g.
+
+  {
+    "label": "Plasma current",
+    "units": "kA",
+    "desc": "Processed from amc_plasma current",
+    "dims": [{"file": "time.npy", "name": "t", "label": "Time", "units": "s"}],
+    "order": 0
+  }
+
+All keys are optional. Each entry in "dims" gives the file holding
+that dimension's values, or is just the file name. Files used as
+dimensions are not listed as signals. Dimensions without a file are
+indices.
+
+Files are memory mapped, so reading a signal costs almost nothing
+until its data is used, and items are read-only views of the files.
+Dimensions read from the same file are shared between signals, and
+interned once each time the file changes.
+
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from .pyxpad_utils import (XPadDataItem, XPadDataDim, XPadDataInfo, XPadVarInfo, UniformDim,
+                           isUniform, subset, timebases)
+
+
+def mtimeOrNone(filename):
+    """Modification time of a file, or None if it doesn't exist"""
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+
+def loadSidecar(filename):
+    """
+    Dictionary from a JSON sidecar file, or {} if there isn't one
+    """
+    try:
+        with open(filename, 'r') as f:
+            meta = json.load(f)
+    except (OSError, IOError):
+        return {}
+    except ValueError as e:
+        print("WARNING: Ignoring '{}': {}".format(filename, e))
+        return {}
+    if not isinstance(meta, dict):
+        return {}
+    dims = meta.get("dims", [])
+    meta["dims"] = [{"file": d} if isinstance(d, str) else d for d in dims]
+    return meta
+
+
+class NpyDirSource:
+    """
+
+    Functions
+      read( name, shot )   Input signal name (string)
+                           Output is an XPadDataItem object or None
+
+      probe( name )  Size and type of a signal, without reading it.
+                     Output is an XPadDataInfo object or None
+
+      size( name )   Returns signal size as a list. [] for scalar
+
+    Attributes
+
+      label         A short string to describe the source
+      varNames      A list of signal names
+      variables     A dictionary of XPadVarInfo objects
+
+    The directory is re-listed if its modification time changes.
+    """
+
+    _listing = None
+
+    def __init__(self, path):
+        self.path = path
+        self.label = path
+        self.config = {}
+        self._lock = threading.Lock()
+        self._dims = {}  # file path -> (mtime, XPadDataDim)
+        self._sidecars = {}  # signal name -> (mtime, sidecar dictionary)
+        if len(self.listing()[1]) == 0:
+            raise ValueError("No .npy files in " + path)
+
+    def listing(self):
+        """
+        (mtime, {name: sidecar dictionary}) for the signals in the directory
+        """
+        mtime = os.path.getmtime(self.path)
+        listing = self._listing
+        if listing is not None and listing[0] == mtime:
+            return listing
+
+        ls = os.listdir(self.path)
+        signals = {}
+        for fname in ls:
+            name, ext = os.path.splitext(fname)
+            if ext == ".npy":
+                signals[name] = loadSidecar(os.path.join(self.path, name + ".json"))
+        # Files used as dimensions aren't signals
+        for meta in list(signals.values()):
+            for dim in meta.get("dims", []):
+                dimname = os.path.splitext(dim.get("file") or "")[0]
+                signals.pop(dimname, None)
+        self._listing = (mtime, signals)
+        return self._listing
+
+    @property
+    def varNames(self):
+        return sorted(self.listing()[1].keys())
+
+    @property
+    def variables(self):
+        """A dictionary of XPadVarInfo objects"""
+        return {name: XPadVarInfo(name, self.path, meta.get("label", ""),
+                                  meta.get("units", ""), meta.get("desc", ""))
+                for name, meta in self.listing()[1].items()}
+
+    def __getstate__(self):
+        # Files are mapped again when needed
+        state = self.__dict__.copy()
+        for name in ['_lock', '_dims', '_listing', '_sidecars']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._dims = {}
+        self._sidecars = {}
+
+    def filename(self, name):
+        return os.path.join(self.path, name + ".npy")
+
+    def sidecar(self, name):
+        """
+        Sidecar dictionary for a signal, read again if the sidecar
+        file changes. None if there is no such signal
+        """
+        if name not in self.listing()[1]:
+            return None
+        filename = os.path.join(self.path, name + ".json")
+        mtime = mtimeOrNone(filename)
+        entry = self._sidecars.get(name)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, loadSidecar(filename))
+            self._sidecars[name] = entry
+        return entry[1]
+
+    def readKey(self, name, shot):
+        """
+        Identifies the data read, so that identical reads of the
+        same version of the signal, its sidecar and dimension files
+        can be shared
+        """
+        meta = self.sidecar(name)
+        if meta is None:
+            return None
+        filename = os.path.abspath(self.filename(name))
+        files = [filename, os.path.join(self.path, name + ".json")]
+        files += [os.path.join(self.path, dim["file"])
+                  for dim in meta.get("dims", []) if dim.get("file")]
+        mtimes = tuple(mtimeOrNone(f) for f in files)
+        if mtimes[0] is None:
+            return None
+        return (filename, mtimes)
+
+    def dimension(self, spec, length, index):
+        """
+        XPadDataDim for a dimension of the given length. Dimensions
+        from the same file are shared, and only read again if the
+        file changes
+        """
+        fname = spec.get("file")
+        if not fname:
+            dim = UniformDim(0, 1, length)
+        else:
+            fname = os.path.join(self.path, fname)
+            mtime = os.path.getmtime(fname)
+            with self._lock:
+                entry = self._dims.get(fname)
+                if entry is None or entry[0] != mtime:
+                    dim = XPadDataDim()
+                    # Hashed once here, rather than by every read
+                    dim.data = timebases.intern(np.load(fname, mmap_mode='r'))
+                    dim.name = spec.get("name", os.path.splitext(spec["file"])[0])
+                    dim.label = spec.get("label", dim.name)
+                    dim.units = spec.get("units", "")
+                    entry = (mtime, dim)
+                    self._dims[fname] = entry
+            dim = entry[1]
+            if len(dim.data) != length:
+                raise ValueError("Dimension {} of length {} doesn't match signal length {}"
+                                 .format(index, len(dim.data), length))
+            return dim
+        dim.name = spec.get("name", "dim{}".format(index))
+        dim.label = spec.get("label", dim.name)
+        dim.units = spec.get("units", "")
+        return dim
+
+    def read(self, name, shot, trange=None, npoints=None):
+        """Read a signal.
+
+        trange    Optional (min, max) range of the time dimension
+        npoints   Optional maximum number of points in time.
+                  The data is strided to fit
+
+        The data is a read-only memory-mapped view of the file
+        """
+        meta = self.sidecar(name)
+        if meta is None:
+            return None
+        data = np.load(self.filename(name), mmap_mode='r')
+
+        item = XPadDataItem()
+        item.name = name
+        item.source = self.path
+        item.label = meta.get("label", "")
+        item.units = meta.get("units", "")
+        item.desc = meta.get("desc", "")
+        item.data = data
+        specs = meta.get("dims", [])
+        item.dim = [self.dimension(specs[i] if i < len(specs) else {}, n, i)
+                    for i, n in enumerate(data.shape)]
+        if item.dim:
+            item.order = meta.get("order", 0)
+            if not isUniform(item.dim[item.order]):
+                # Index values are only made when needed. See timeValues
+                item.time = item.dim[item.order].data
+        return subset(item, trange, npoints)
+
+    def probe(self, name, shot=""):
+        """Size and type of a signal, from the file header."""
+        meta = self.sidecar(name)
+        if meta is None:
+            return None
+        data = np.load(self.filename(name), mmap_mode='r')
+        trange = None
+        order = meta.get("order", 0)
+        if 0 <= order < data.ndim and data.shape[order] > 0:
+            specs = meta.get("dims", [])
+            dim = self.dimension(specs[order] if order < len(specs) else {},
+                                 data.shape[order], order)
+            if isUniform(dim):
+                trange = (dim.start, dim.end)
+            else:
+                # Only the ends of the mapped file are read
+                trange = (dim.data[0], dim.data[-1])
+        return XPadDataInfo(data.shape, data.dtype, trange)
+
+    def size(self, name):
+        info = self.probe(name)
+        if info is None:
+            return []
+        return list(info.shape)
@@ -0,0 +1,462 @@
+"""
+IDL XPAD save files (.padsav) as a data source
+
+scipy.io.readsav can only decode a whole file at once, so each file
+is decoded at most once, when first read, and only a few decoded files
+are kept. Trace names are kept in an index saved between sessions, so
+listing a file's traces doesn't decode it again. Traces are only
+checked and converted to XPadDataItem objects when read.
+
+"""
+
+from collections import OrderedDict
+from collections.abc import Mapping
+from warnings import catch_warnings, simplefilter
+import os
+import pickle
+import threading
+
+from numpy import rollaxis
+from scipy.io import readsav
+
+from .cache import cache_dir
+from .pyxpad_utils import XPadDataItem, XPadDataDim, XPadDataInfo, XPadVarInfo, UniformDim, isUniform
+
+# Maximum number of decoded files kept at once
+maxOpenFiles = 4
+
+_openFiles = OrderedDict()  # (path, mtime) -> readsav dict, least recently used first
+_openFilesLock = threading.Lock()
+
+
+def text(value):
+    """
+    Strings are read from save files as bytes
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def loadPadsav(path):
+    """
+    The readsav dictionary for a save file, decoded if not
+    already open. At most maxOpenFiles are kept
+    """
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    with _openFilesLock:
+        if key in _openFiles:
+            _openFiles.move_to_end(key)
+            return _openFiles[key]
+    with catch_warnings():
+        simplefilter("ignore", UserWarning)
+        idl_dict = readsav(path)
+    with _openFilesLock:
+        _openFiles[key] = idl_dict
+        _openFiles.move_to_end(key)
+        while len(_openFiles) > maxOpenFiles:
+            _openFiles.popitem(last=False)
+    return idl_dict
+
+
+def traceInfo(trace):
+    """
+    (name, label, units, type, shape) for a trace, without
+    converting its data. None if this isn't a trace
+    """
+    try:
+        name = text(trace['NAME'][0])
+        sizes = [int(n) for n in trace['SIZE'][0][1:trace['SIZE'][0][0] + 1]]
+        # Same order as parse_trace's dimensions: t, (y,) x
+        shape = tuple(sizes[:1] + sizes[1:][::-1])
+        return (name, text(trace['DINFO'][0]['LABEL'][0]),
+                text(trace['DINFO'][0]['UNITS'][0]),
+                text(trace['TYPE'][0]), shape)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def parse_trace(trace):
+    """
+        Converts a trace from an XPad *.padsav into an XPadDataItem
+
+        Parameters
+        ----------
+        trace : numpy.recarray
+            A trace from imported XPad *.padsav data
+
+
+        Returns
+        -------
+        item : XPadDataItem
+    """
+    item = XPadDataItem()
+
+    item.name = text(trace['NAME'][0])
+    item.source = text(trace['SOURCE'][0])
+    item.label = text(trace['DINFO'][0]['LABEL'][0])
+    item.units = text(trace['DINFO'][0]['UNITS'][0])
+    item.dim = []
+
+    numdims = trace['SIZE'][0][0]
+
+    item.data = rollaxis(trace['DATA'][0], numdims - 1)
+
+    if numdims > 0:
+        # f(t), f(t,x) or f(t,x,y)
+
+        # If we have a time domain, it is uniform, from TINFO
+        if trace['TINFO'][0]['DOMAINS'][0] > 0:
+            start = float(trace['TINFO'][0]['START'][0])
+            finish = float(trace['TINFO'][0]['FINISH'][0])
+            length = int(trace['TINFO'][0]['LENGTH'][0])
+            step = (finish - start) / (length - 1) if length > 1 else 0.0
+            dim = UniformDim(start, step, length)
+        else:
+            dim = XPadDataDim()
+            dim.data = trace['TIME'][0]
+
+        dim.name = text(trace['TINFO'][0]['LABEL'][0])
+        dim.label = dim.name
+        dim.units = text(trace['TINFO'][0]['UNITS'][0])
+
+        item.dim.append(dim)
+
+        item.order = len(item.dim) - 1
+        if not isUniform(dim):
+            # Uniform time values are only made when needed. See timeValues
+            item.time = dim.data
+
+    if numdims > 2:
+        # f(t,x,y)
+        dim = XPadDataDim()
+        dim.data = trace['Y'][0]
+        dim.name = text(trace['YINFO'][0]['LABEL'][0])
+        dim.label = dim.name
+        dim.units = text(trace['YINFO'][0]['UNITS'][0])
+
+        item.dim.append(dim)
+
+    if numdims > 1:
+        # f(t,x) or f(t,x,y)
+        dim = XPadDataDim()
+        dim.data = trace['X'][0]
+        dim.name = text(trace['XINFO'][0]['LABEL'][0])
+        dim.label = dim.name
+        dim.units = text(trace['XINFO'][0]['UNITS'][0])
+
+        item.dim.append(dim)
+
+    item.desc = text(trace['TYPE'][0])
+
+    return item
+
+
+def check_padsav(xpad_idl_dict):
+    """
+        Verifies padsav data and its containing traces are valid.
+
+        Parameters
+        ----------
+        xpad_idl_dict : AttrDict or dict
+            An XPad *.padsav imported using scipy.io.readsav
+
+
+        Returns
+        -------
+        int : 0 for invalid, 1 for valid
+    """
+    if not isinstance(xpad_idl_dict, dict):
+        return 0
+
+    if 'ptr' not in xpad_idl_dict:
+        return 0
+
+    # [*] 'ptr not found in xpad_idl_dict'
+    if not xpad_idl_dict['ptr'].size:
+        return 0
+
+    for trace in xpad_idl_dict['ptr']:
+        # [*] failed on trace
+        if not check_trace(trace):
+            return 0
+
+    return 1
+
+
+def check_trace(xpad_idl_trace):
+    """
+        Verifies a trace is well-formed and valid
+
+        Parameters
+        ----------
+        xpad_idl_trace : numpy.recarray
+            A trace from imported XPad *.padsav data
+
+
+        Returns
+        -------
+        int : 0 for invalid, 1 for valid
+    """
+    from numpy import prod, recarray
+
+    # [*] 'xpad_idl_trace is not an instance of numpy.core.records.recarray'
+    if not isinstance(xpad_idl_trace, recarray):
+        return 0
+
+    # [*] 'UTYPE != \'DBstructure\''
+    if 'UTYPE' not in xpad_idl_trace.dtype.names or not text(xpad_idl_trace['UTYPE'][0]) == 'DBstructure':
+        return 0
+
+    for field in ['TYPE', 'NAME', 'DATA', 'DINFO', 'SOURCE', 'PROCESS', 'SIZE', 'TINFO']:
+        # [*] 'Required field missing: '+field
+        if field not in xpad_idl_trace.dtype.names:
+            return 0
+
+    # [*] TINFO.UTYPE != \'TINFO\'
+    if 'UTYPE' not in xpad_idl_trace['TINFO'][0].dtype.names or not text(xpad_idl_trace['TINFO'][0]['UTYPE'][0]) == 'TINFO':
+        return 0
+
+    for field in ['DOMAINS', 'START', 'FINISH', 'STEP', 'SAMPLES', 'LENGTH', 'UNITS', 'LABEL']:
+        # [*] 'Required TINFO field missing: '+field
+        if field not in xpad_idl_trace['TINFO'][0].dtype.names:
+            return 0
+
+    types = ['f(t)', 'f(t,x)', 'f(t,x,y)']
+    # [*] 'TYPE is not one of '+str(types)
+    if not text(xpad_idl_trace['TYPE'][0]) in types:
+        return 0
+
+    sizes = xpad_idl_trace['SIZE'][0]
+    numdims = sizes[0]
+    # [*] 'size(DATA) != prod(dim_sizes)'
+    if not xpad_idl_trace['DATA'][0].size == prod(sizes[1:
+    ]): return 0
+
+    # [*] 'Incorrect numdims for shape of DATA'
+    if not numdims == len(xpad_idl_trace['DATA'][0].shape):
+        return 0
+
+    # [*] 'Incorrect numdims in SIZE for TYPE'
+    if not numdims == types.index(text(xpad_idl_trace['TYPE'][0])) + 1:
+        return 0
+
+    if numdims > 0:
+        if xpad_idl_trace['TINFO'][0]['DOMAINS'][0] < 1:
+            if 'TIME' in xpad_idl_trace.dtype.names:
+                # [*] 'size(TIME) != SIZE[1]':
+                if not xpad_idl_trace['TIME'][0].size == sizes[1]:
+                    return 0
+
+                # Should this always be true?
+                # [*] 'size(TIME) != TINFO.LENGTH':
+                #if not xpad_idl_trace['TIME'][0].size == xpad_idl_trace['TINFO'][0]['LENGTH'][0]: return 0
+            else:
+                # Can't determine TIME dimension
+                # [*] 'TINFO contains no domains and TIME field does not exist'
+                return 0
+        else:
+            # [*] 'TINFO.START > TINFO.FINISH'
+            if not xpad_idl_trace['TINFO'][0]['START'][0] <= xpad_idl_trace['TINFO'][0]['FINISH'][0]:
+                return 0
+
+            # [*] 'TINFO.LENGTH is < 1'
+            if not xpad_idl_trace['TINFO'][0]['LENGTH'][0] >= 1:
+                return 0
+
+    if numdims > 1:
+        for field in ["X", "XINFO"]:
+            # [*] 'Required field missing: '+field
+            if field not in xpad_idl_trace.dtype.names:
+                return 0
+
+        # [*] 'size(X) != SIZE[2]':
+        if not xpad_idl_trace['X'][0].size == sizes[2]:
+            return 0
+
+    if numdims > 2:
+        for field in ["Y", "YINFO"]:
+            # [*] 'Required field missing: '+field
+            if field not in xpad_idl_trace.dtype.names:
+                return 0
+
+        # [*] 'size(Y) != SIZE[3]':
+        if not xpad_idl_trace['Y'][0].size == sizes[3]:
+            return 0
+
+    # Add more checks if you so desire
+    # ...
+    return 1
+
+
+class PadsavIndex:
+    """
+    Trace names and sizes for save files, saved between sessions
+    so that files don't need to be decoded just to list them.
+    Entries are re-made if the file's modification time changes.
+    """
+
+    filename = os.path.join(cache_dir, "padsav-index.pkl")
+
+    def __init__(self):
+        self.files = {}  # path -> (mtime, [(name, label, units, type, shape), ...])
+        self._lock = threading.Lock()
+        try:
+            with open(self.filename, 'rb') as f:
+                self.files = pickle.load(f)
+        except Exception:
+            pass  # No index, or not readable. Start again
+
+    def traces(self, path):
+        """
+        List of (position, name, label, units, type, shape) for the
+        traces in a save file. position is the index into 'ptr'
+        """
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            entry = self.files.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        traces = []
+        idl_dict = loadPadsav(path)
+        ptr = idl_dict.get('ptr', [])
+        for position, trace in enumerate(ptr):
+            info = traceInfo(trace)
+            if info is not None:
+                traces.append((position,) + info)
+
+        with self._lock:
+            self.files[path] = (mtime, traces)
+            self.save()
+        return traces
+
+    def save(self):
+        """
+        Write the index to file. Must be called with self._lock held
+        """
+        tmpname = self.filename + ".{}.tmp".format(os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(tmpname, 'wb') as f:
+                pickle.dump(self.files, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self.filename)
+        except (OSError, IOError):
+            # Index is only an optimisation
+            pass
+
+
+_index = None
+
+
+def getIndex():
+    global _index
+    if _index is None:
+        _index = PadsavIndex()
+    return _index
+
+
+class PadsavVariables(Mapping):
+    """
+    Dictionary of XPadVarInfo objects, one
+    for each trace in a PadsavSource, made from the index
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def __getitem__(self, name):
+        _, name, label, units, type, shape = self.source.traces()[name]
+        return XPadVarInfo(name, self.source.filename, label, units, type)
+
+    def __iter__(self):
+        return iter(self.source.traces())
+
+    def __len__(self):
+        return len(self.source.traces())
+
+
+class PadsavSource:
+    """
+    Traces in an IDL XPAD save file
+
+    Functions
+      read( name, shot )   Input trace name (string)
+                           Output is an XPadDataItem object or None
+
+      probe( name )  Size of a trace, from the index.
+                     Output is an XPadDataInfo object or None
+
+    Attributes
+
+      label         A short string to describe the source
+      varNames      A list of trace names
+      variables     A dictionary of XPadVarInfo objects
+
+    """
+
+    _traces = None
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.label = filename
+        self.config = {}
+        if len(self.traces()) == 0:
+            raise ValueError("No XPAD traces in " + filename)
+
+    def traces(self):
+        """
+        OrderedDict of trace name -> (position, name, label, units, type, shape)
+        """
+        mtime = os.path.getmtime(self.filename)
+        if self._traces is None or self._traces[0] != mtime:
+            traces = OrderedDict((t[1], t) for t in getIndex().traces(self.filename))
+            self._traces = (mtime, traces)
+        return self._traces[1]
+
+    @property
+    def varNames(self):
+        return list(self.traces().keys())
+
+    @property
+    def variables(self):
+        """A dictionary of XPadVarInfo objects"""
+        return PadsavVariables(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_traces', None)
+        return state
+
+    def readKey(self, name, shot):
+        """
+        Identifies the data read, so that identical reads
+        of the same version of the file can be shared
+        """
+        filename = os.path.abspath(self.filename)
+        return (filename, os.path.getmtime(filename), name)
+
+    def read(self, name, shot):
+        """
+        Decode a trace. The file is decoded if not already open
+        """
+        entry = self.traces().get(name)
+        if entry is None:
+            return None
+        trace = loadPadsav(self.filename)['ptr'][entry[0]]
+        if not check_trace(trace):
+            raise ValueError("Invalid XPAD trace '{}' in {}".format(name, self.filename))
+        return parse_trace(trace)
+
+    def probe(self, name, shot=""):
+        entry = self.traces().get(name)
+        if entry is None:
+            return None
+        return XPadDataInfo(entry[5])
+
+    def size(self, name):
+        entry = self.traces().get(name)
+        if entry is None:
+            return []
+        return list(entry[5])
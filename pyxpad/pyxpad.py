@@ -20,10 +20,10 @@ along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from Qt.QtWidgets import (QAbstractItemView, QAction,
-                          QFileDialog, QMainWindow, QMenu, QMessageBox,
+                          QFileDialog, QMainWindow, QMenu, QMessageBox, QShortcut,
                           QStyle, QTableWidgetItem, QTreeWidgetItem, QWidget)
-from Qt.QtGui import (QCursor, QIcon,)
-from Qt.QtCore import Qt, QTextCodec, QDir
+from Qt.QtGui import (QCursor, QIcon, QKeySequence)
+from Qt.QtCore import Qt, QTextCodec, QDir, QTimer
 
 from .pyxpad_main import Ui_MainWindow
 from .configdialog import ConfigDialog
@@ -43,6 +43,7 @@ except ImportError:
 import sys
 import os
 import re
+import queue
 import string
 import fnmatch  # For matching names to wildcard patterns
 from keyword import iskeyword  # Test if a string is a keyword
@@ -51,13 +52,25 @@ import xdg                     # Names of XDG directories for config
 from pyxpad import fourier         # FFT-based methods
 from pyxpad import calculus        # Integration and differentiation methods
 from pyxpad import user_functions  # Miscellaneous useful functions
+from pyxpad.reader import (ReadJob, ReadRequest, Prefetcher, neighbouringShots, decimate,
+                           parseShots, estimate)
+from pyxpad.pyxpad_utils import timeValues
 
 
 class Sources:
     sources = []  # List of sources
+    maxWorkers = 8  # Maximum number of reads in progress at once
+    prefetchWorkers = 2  # Maximum number of background reads at once
+    prefetchBandwidth = 10 * 1024 * 1024  # Bytes per second. None for no limit
+    largeRead = 512 * 1024 * 1024  # Bytes. Ask before reading more than this
+    maxProbes = 64  # Most requests probed to estimate the size of a read
 
     def __init__(self, mainwindow):
         self.main = mainwindow
+        self.job = None  # The batch of reads in progress
+        self.messages = queue.Queue()  # Progress messages from reads
+        self.prefetcher = Prefetcher(max_workers=self.prefetchWorkers,
+                                     bandwidth=self.prefetchBandwidth)
         self.main.sourceDescription.stateChanged.connect(self.updateDisplay)
 
         self.groupIcon = QIcon()
@@ -69,6 +82,7 @@ class Sources:
         self.keyIcon.addPixmap(mainwindow.style().standardPixmap(QStyle.SP_FileIcon))
 
         self.main.treeView.itemSelectionChanged.connect(self.updateDisplay)
+        self.main.treeView.itemExpanded.connect(self.populateItem)
         self.main.tracePattern.returnPressed.connect(self.updateDisplay)
         self.main.treeView.setContextMenuPolicy(Qt.CustomContextMenu)  # Enable popup menus
 
@@ -84,6 +98,16 @@ class Sources:
         self.actionConfig = QAction("Configure", self.main, statusTip="Configure source")
         self.actionConfig.triggered.connect(self.configureSource)
 
+        # Escape or the Cancel button cancels reads in progress
+        self.cancelShortcut = QShortcut(QKeySequence.Cancel, self.main)
+        self.cancelShortcut.activated.connect(self.cancelRead)
+        self.main.cancelReadButton.clicked.connect(self.cancelRead)
+
+        # Checks on reads in progress
+        self.readTimer = QTimer(self.main)
+        self.readTimer.setInterval(50)
+        self.readTimer.timeout.connect(self.pollRead)
+
     def saveState(self, f):
         pickle.dump(self.sources, f)
 
@@ -136,6 +160,81 @@ class Sources:
             self.main.write("Error creating NetCDFDataSource")
             self.main.write(str(sys.exc_info()))
 
+    def addHDF5(self):
+        """
+        Add an HDF5 file as a data source
+        """
+        try:
+            from pyxpad.hdf5source import HDF5DataSource, h5py
+        except ImportError:
+            h5py = None
+        if h5py is None:
+            self.main.write("Sorry, no HDF5 support. Needs h5py")
+            return
+        try:
+            # Get the file name
+            tr = self.main.tr
+            fname, _ = QFileDialog.getOpenFileName(self.main, tr('Open file'), '.',
+                                                   filter=tr("HDF5 files (*.h5 *.hdf5 *.hdf)"))
+            if (fname is None) or (fname == ""):
+                return  # Cancelled
+
+            s = HDF5DataSource(fname)
+
+            self.addSource(s)
+            self.updateDisplay()
+        except:
+            self.main.write("Error creating HDF5DataSource")
+            self.main.write(str(sys.exc_info()))
+
+    def addPadsav(self):
+        """
+        Add an IDL XPAD save file as a data source
+        """
+        try:
+            from pyxpad.padsavsource import PadsavSource
+        except ImportError:
+            self.main.write("Sorry, no XPAD save file support")
+            return
+        try:
+            # Get the file name
+            tr = self.main.tr
+            fname, _ = QFileDialog.getOpenFileName(self.main, tr('Open file'), '.',
+                                                   filter=tr("XPAD save files (*.padsav)"))
+            if (fname is None) or (fname == ""):
+                return  # Cancelled
+
+            s = PadsavSource(fname)
+
+            self.addSource(s)
+            self.updateDisplay()
+        except:
+            self.main.write("Error creating PadsavSource")
+            self.main.write(str(sys.exc_info()))
+
+    def addNpyDir(self):
+        """
+        Add a directory of NumPy .npy files as a data source
+        """
+        try:
+            from pyxpad.npysource import NpyDirSource
+
+            # Select the directory
+            tr = self.main.tr
+            dname = QFileDialog.getExistingDirectory(self.main, tr('Open NumPy directory'),
+                                                     QDir.currentPath())
+            if (dname == "") or (dname is None):
+                return
+            # Create data source
+            s = NpyDirSource(dname)
+
+            # Add data source and update
+            self.addSource(s)
+            self.updateDisplay()
+        except:
+            self.main.write("Error creating NpyDirSource")
+            self.main.write(str(sys.exc_info()))
+
     def addXPADtree(self):
         try:
             from pyxpad.xpadsource import XPadSource
@@ -192,20 +291,42 @@ class Sources:
         it.setIcon(0, self.groupIcon)
         it.source = source
         self.main.treeView.addTopLevelItem(it)
+        self.setChildIndicator(it)
 
-        def buildtree(parent, it):
-            # Check for children
-            try:
-                for child in parent.children:
-                    itchild = QTreeWidgetItem(it, [child.label])
-                    itchild.source = child
-                    buildtree(child, itchild)  # Add child's children
-                    it.addChild(itchild)
-            except AttributeError:
-                # Probably no children
-                return
+    def setChildIndicator(self, it):
+        """
+        Show that a tree item can be expanded, without finding
+        its children. These are added when first expanded
+        """
+        source = it.source
+        try:
+            expandable = source.hasChildren()
+        except AttributeError:
+            expandable = hasattr(source, "children")
+        it.populated = not expandable
+        if expandable:
+            it.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
 
-        buildtree(source, it)
+    def populateItem(self, it):
+        """
+        Add children of a tree item, if not already added.
+        Called when an item is expanded
+        """
+        if getattr(it, "populated", True):
+            return
+        it.populated = True
+        try:
+            children = it.source.children
+        except AttributeError:
+            # Probably no children
+            children = []
+        for child in children:
+            itchild = QTreeWidgetItem(it, [child.label])
+            itchild.source = child
+            self.setChildIndicator(itchild)
+            it.addChild(itchild)
+        if len(children) == 0:
+            it.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
 
     def deleteSource(self):
         tree = self.main.treeView
@@ -320,44 +441,171 @@ class Sources:
             if name not in sel:
                 addVar(name, s)
 
-    def read(self):
+    def read(self, callback):
         """
-        Read the selected data and return as a list of data items
+        Start reading the selected data. Returns immediately,
+        and the window remains responsive while reading.
 
         Input
         -----
-            None
+            callback  Function called with the list of data items
+                      [ XPadDataItem ] or equivalent, once all reads finish.
+                      Not called if the reads are cancelled
 
         Returns
         ------
-            [ XPadDataItem ]  or equivalent
+            The ReadJob, or None if there is nothing to read
 
         Modifies
         --------
             None
         """
 
-        # Get list of shots
-        shotlist = self.main.shotInput.text().split(',')
+        if self.job is not None:
+            self.main.write("** Already reading data. Press Cancel to stop")
+            return None
+
+        # Foreground reads take priority
+        self.prefetcher.cancel()
+
+        # Get list of shots, expanding ranges e.g. 29000-29200:5
+        try:
+            shotlist = parseShots(self.main.shotInput.text())
+        except ValueError as e:
+            self.main.write("** " + str(e))
+            return None
+
+        requests = self.selectedRequests(shotlist)
+        if len(requests) == 0:
+            return None
+
+        if not self.checkSize(requests):
+            return None
+
+        # Progress is reported from worker threads, so pass
+        # messages back to be written here
+        self.messages = queue.Queue()
+
+        if len(shotlist) > 1:
+            # Report each shot once all its reads have finished
+            remaining = {}
+            for req in requests:
+                remaining[req.shot] = remaining.get(req.shot, 0) + 1
+            shotsdone = []
+
+            def progress(req, ndone, ntotal):
+                remaining[req.shot] -= 1
+                if remaining[req.shot] == 0:
+                    shotsdone.append(req.shot)
+                    self.messages.put("[{}/{} shots] Read shot {}".format(
+                        len(shotsdone), len(remaining), req.shot))
+        else:
+            def progress(req, ndone, ntotal):
+                self.messages.put("[{}/{}] Read {}".format(ndone, ntotal, req))
+
+        self.main.write("Reading {} items from {} shot(s)".format(len(requests), len(shotlist)))
+        self.job = ReadJob(requests, max_workers=self.maxWorkers, progress=progress).start()
+        self.readCallback = callback
+
+        self.main.readDataButton.setEnabled(False)
+        self.main.cancelReadButton.setEnabled(True)
+        self.readTimer.start()
+        return self.job
+
+    def checkSize(self, requests):
+        """
+        Estimate the size of the requests, and if more than largeRead
+        ask whether to read it all, read fewer points, or cancel.
+        Returns False if cancelled
+
+        Only a sample of at most maxProbes requests is probed, since
+        each probe may open a file, and this runs in the GUI thread
+        """
+        total = estimate(requests, maxprobes=self.maxProbes, max_workers=self.maxWorkers)
+        if total <= self.largeRead:
+            return True
+
+        mbytes = total / (1024. * 1024.)
+        reply = QMessageBox.question(
+            self.main, "Large read",
+            "The selected data is about {:.0f} MB.\n\n"
+            "Read fewer points from each signal?\n"
+            "(No reads all the data)".format(mbytes),
+            QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel,
+            QMessageBox.Yes)
+        if reply == QMessageBox.Cancel:
+            return False
+        if reply == QMessageBox.Yes:
+            total = decimate(requests, self.largeRead)
+            self.main.write("Reading fewer points: about {:.0f} MB"
+                            .format(total / (1024. * 1024.)))
+        return True
+
+    def pollRead(self):
+        """
+        Called periodically while reading, to report progress
+        and finish when all reads are done
+        """
+        while not self.messages.empty():
+            self.main.write(self.messages.get())
 
+        job = self.job
+        if job is None or not job.poll():
+            return
+
+        self.readTimer.stop()
+        self.job = None
+        self.main.readDataButton.setEnabled(True)
+        self.main.cancelReadButton.setEnabled(False)
+
+        if job.cancelled:
+            self.main.write("** Read cancelled")
+            return
+
+        # Failed and missing reads are skipped, and summarised
+        for line in job.summary():
+            self.main.write(line)
+
+        self.readCallback(job.results())
+
+        # The next shots are likely to be read next
+        self.prefetch(neighbouringShots(job.requests))
+
+    def cancelRead(self):
+        """
+        Cancel the batch of reads in progress, if any
+        """
+        if self.job is not None:
+            self.job.cancel()
+            self.pollRead()
+
+    def selectedRequests(self, shotlist):
+        """
+        List of ReadRequest objects for the variables selected
+        in the source table, for each shot in shotlist
+        """
         table = self.main.sourceTable
         tableitems = table.selectedItems()
-        data = []
+        requests = []
         for item in tableitems:
             if 'source' in item.__dict__:
                 name = item.text()
-
                 for shot in shotlist:
-                    s = "Reading " + name + " from " + item.source.label
-                    if shot != "":
-                        s += " shot = " + shot
-                    self.main.write(s)
-                    # Run in a sandbox to catch exceptions and display output
-                    self.main.runSandboxed(lambda: data.append(item.source.read(name, shot)))
-
+                    requests.append(ReadRequest(item.source, name, shot))
             else:
                 print("Ignoring "+item.text())
-        return data
+        return requests
+
+    def prefetch(self, requests):
+        """
+        Read data in the background into the sources' caches.
+        Only for sources with 'Prefetch' enabled in their config
+        """
+        def enabled(source):
+            config = getattr(source, 'config', {})
+            return config.get('Prefetch', False) and config.get('Cache', False)
+
+        self.prefetcher.start([req for req in requests if enabled(req.source)])
 
 
 class PyXPad(QMainWindow, Ui_MainWindow):
@@ -376,6 +624,9 @@ class PyXPad(QMainWindow, Ui_MainWindow):
 
         # File menu
         self.actionNetCDF_file.triggered.connect(self.sources.addNetCDF)
+        self.actionHDF5_file.triggered.connect(self.sources.addHDF5)
+        self.actionPadsav_file.triggered.connect(self.sources.addPadsav)
+        self.actionNpy_dir.triggered.connect(self.sources.addNpyDir)
         self.actionXPAD_tree.triggered.connect(self.sources.addXPADtree)
         self.actionBOUT_data.triggered.connect(self.sources.addBOUT)
 
@@ -611,17 +862,21 @@ class PyXPad(QMainWindow, Ui_MainWindow):
             self.data
 
 
-        Calls Sources to read the new data
-
-        Inserts data into self.data, ensuring that the name
-        of each data item is unique and a valid Python name
-
-        Updates the data table based on self.data
+        Calls Sources to start reading the new data. Once all
+        reads finish, addData inserts the data into self.data
+        and updates the data table
         """
         # Switch to data tab
         self.tabWidget.setCurrentWidget(self.dataTab)
-        # Get the data from the source as a list
-        newdata = self.sources.read()
+        # Get the data from the source as a list, once read
+        self.sources.read(self.addData)
+
+    def addData(self, newdata):
+        """
+        Add a list of data items to self.data, ensuring that the name
+        of each data item is unique and a valid Python name.
+        Updates the data table
+        """
         if (newdata is None) or (newdata == []):
             return  # No data read
 
@@ -655,6 +910,9 @@ class PyXPad(QMainWindow, Ui_MainWindow):
         data_item = source.read("lastshot", "")
         last_shot_number = data_item.data.children[0].lastshot
 
+        # The newest shot is likely to be read next
+        self.sources.prefetch(self.sources.selectedRequests([str(last_shot_number)]))
+
         # Append the shot number to any existing shot numbers
         current_text = self.sources.main.shotInput.text()
         if current_text == '':
@@ -973,12 +1231,9 @@ class PyXPad(QMainWindow, Ui_MainWindow):
         try:
             # Get current time range from first variable
             var = self.data[names[0]]
-            if var.time is not None:
-                tmin = var.time[0]
-                tmax = var.time[-1]
-            else:
-                tmin = var.dim[0].data[0]
-                tmax = var.dim[0].data[-1]
+            time = timeValues(var)
+            tmin = time[0]
+            tmax = time[-1]
         except:
             return
 
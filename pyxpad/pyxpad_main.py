@@ -35,25 +35,29 @@ class Ui_MainWindow(object):
         self.gridLayout.setObjectName("gridLayout")
         self.sourceDescription = QCheckBox(self.sourceTab)
         self.sourceDescription.setObjectName("sourceDescription")
-        self.gridLayout.addWidget(self.sourceDescription, 0, 6, 1, 1)
+        self.gridLayout.addWidget(self.sourceDescription, 0, 7, 1, 1)
         self.shotLabel = QLabel(self.sourceTab)
         self.shotLabel.setObjectName("shotLabel")
         self.gridLayout.addWidget(self.shotLabel, 0, 0, 1, 1)
         self.tracePattern = QLineEdit(self.sourceTab)
         self.tracePattern.setObjectName("tracePattern")
-        self.gridLayout.addWidget(self.tracePattern, 0, 5, 1, 1)
+        self.gridLayout.addWidget(self.tracePattern, 0, 6, 1, 1)
         self.shotInput = QLineEdit(self.sourceTab)
         self.shotInput.setObjectName("shotInput")
         self.gridLayout.addWidget(self.shotInput, 0, 1, 1, 1)
         self.readDataButton = QPushButton(self.sourceTab)
         self.readDataButton.setObjectName("readDataButton")
         self.gridLayout.addWidget(self.readDataButton, 0, 2, 1, 1)
+        self.cancelReadButton = QPushButton(self.sourceTab)
+        self.cancelReadButton.setEnabled(False)
+        self.cancelReadButton.setObjectName("cancelReadButton")
+        self.gridLayout.addWidget(self.cancelReadButton, 0, 3, 1, 1)
         self.traceLabel = QLabel(self.sourceTab)
         self.traceLabel.setObjectName("traceLabel")
-        self.gridLayout.addWidget(self.traceLabel, 0, 4, 1, 1)
+        self.gridLayout.addWidget(self.traceLabel, 0, 5, 1, 1)
         self.lastShotButton = QPushButton(self.sourceTab)
         self.lastShotButton.setObjectName("lastShotButton")
-        self.gridLayout.addWidget(self.lastShotButton, 0, 3, 1, 1)
+        self.gridLayout.addWidget(self.lastShotButton, 0, 4, 1, 1)
         self.gridLayout_3.addLayout(self.gridLayout, 0, 0, 1, 1)
         self.splitter = QSplitter(self.sourceTab)
         self.splitter.setOrientation(QtCore.Qt.Horizontal)
@@ -164,6 +168,12 @@ class Ui_MainWindow(object):
         self.actionXPAD_tree.setObjectName("actionXPAD_tree")
         self.actionNetCDF_file = QAction(MainWindow)
         self.actionNetCDF_file.setObjectName("actionNetCDF_file")
+        self.actionHDF5_file = QAction(MainWindow)
+        self.actionHDF5_file.setObjectName("actionHDF5_file")
+        self.actionPadsav_file = QAction(MainWindow)
+        self.actionPadsav_file.setObjectName("actionPadsav_file")
+        self.actionNpy_dir = QAction(MainWindow)
+        self.actionNpy_dir.setObjectName("actionNpy_dir")
         self.actionPlot = QAction(MainWindow)
         self.actionPlot.setObjectName("actionPlot")
         self.actionOPlot = QAction(MainWindow)
@@ -249,6 +259,9 @@ class Ui_MainWindow(object):
         self.actionDeleteTrace = QAction(MainWindow)
         self.actionDeleteTrace.setObjectName("actionDeleteTrace")
         self.menuAdd_source.addAction(self.actionNetCDF_file)
+        self.menuAdd_source.addAction(self.actionHDF5_file)
+        self.menuAdd_source.addAction(self.actionPadsav_file)
+        self.menuAdd_source.addAction(self.actionNpy_dir)
         self.menuAdd_source.addAction(self.actionXPAD_tree)
         self.menuAdd_source.addAction(self.actionBOUT_data)
         self.menuFile.addAction(self.menuAdd_source.menuAction())
@@ -316,6 +329,9 @@ class Ui_MainWindow(object):
         self.sourceDescription.setText(QApplication.translate("MainWindow", "Description", None, UnicodeUTF8))
         self.shotLabel.setText(QApplication.translate("MainWindow", "Shot:", None, UnicodeUTF8))
         self.readDataButton.setText(QApplication.translate("MainWindow", "&Read", None, UnicodeUTF8))
+        self.cancelReadButton.setToolTip(QApplication.translate("MainWindow", "Cancel reads in progress", None, UnicodeUTF8))
+        self.shotInput.setToolTip(QApplication.translate("MainWindow", "Shots, e.g. 29000, 29010-29100:5, @shots.txt", None, UnicodeUTF8))
+        self.cancelReadButton.setText(QApplication.translate("MainWindow", "Cancel", None, UnicodeUTF8))
         self.traceLabel.setText(QApplication.translate("MainWindow", "Trace:", None, UnicodeUTF8))
         self.lastShotButton.setToolTip(QApplication.translate("MainWindow", "Get last shot number", None, UnicodeUTF8))
         self.lastShotButton.setText(QApplication.translate("MainWindow", "&Last shot", None, UnicodeUTF8))
@@ -342,6 +358,10 @@ class Ui_MainWindow(object):
         self.actionXPAD_tree.setText(QApplication.translate("MainWindow", "XPAD tree", None, UnicodeUTF8))
         self.actionXPAD_tree.setToolTip(QApplication.translate("MainWindow", "Load a tree of XPAD items", None, UnicodeUTF8))
         self.actionNetCDF_file.setText(QApplication.translate("MainWindow", "NetCDF file", None, UnicodeUTF8))
+        self.actionHDF5_file.setText(QApplication.translate("MainWindow", "HDF5 file", None, UnicodeUTF8))
+        self.actionPadsav_file.setText(QApplication.translate("MainWindow", "XPAD save file", None, UnicodeUTF8))
+        self.actionNpy_dir.setText(QApplication.translate("MainWindow", "NumPy directory", None, UnicodeUTF8))
+        self.actionNpy_dir.setToolTip(QApplication.translate("MainWindow", "Read a directory of .npy files", None, UnicodeUTF8))
         self.actionPlot.setText(QApplication.translate("MainWindow", "&Plot", None, UnicodeUTF8))
         self.actionOPlot.setText(QApplication.translate("MainWindow", "&OPlot", None, UnicodeUTF8))
         self.actionMPlot.setText(QApplication.translate("MainWindow", "&MPlot", None, UnicodeUTF8))
@@ -17,7 +17,149 @@
 # You should have received a copy of the GNU General Public License
 # along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
 
-from numpy import sqrt, abs, max
+import hashlib
+import threading
+import weakref
+
+from numpy import (sqrt, abs, max, asarray, ceil, floor, searchsorted, prod, arange,
+                   ascontiguousarray, ndarray, dtype as npdtype)
+
+
+def slotState(obj):
+    """
+    Dictionary of the attributes of obj for pickling, including
+    those stored in __slots__ by obj's class and its bases
+    """
+    state = dict(getattr(obj, "__dict__", {}))
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if name.startswith("__"):
+                continue
+            try:
+                state[name] = cls.__dict__[name].__get__(obj, cls)
+            except AttributeError:
+                pass  # Not set
+    return state
+
+
+def setSlotState(obj, state):
+    """
+    Set the attributes of obj from a pickled state dictionary.
+    Also accepts the state of objects pickled before their class had
+    __slots__. Attributes the class no longer has are ignored
+    """
+    if isinstance(state, tuple):
+        # (__dict__, slots) pickled without __getstate__
+        state = dict(state[0] or {}, **(state[1] or {}))
+    for name, value in state.items():
+        try:
+            setattr(obj, name, value)
+        except AttributeError:
+            pass
+
+
+class TimebaseTable:
+    """
+    Interned dimension arrays, so that signals with the same
+    timebase share one array, and comparing them is O(1)
+
+    Arrays are identified by a fingerprint: their shape, dtype and
+    a hash of their values. Interned arrays are read-only copies,
+    unless the values given already can't change, so fingerprints
+    stay valid and callers' arrays are left alone. Only weak
+    references are kept, so arrays are freed when no longer used.
+    """
+
+    def __init__(self):
+        self._arrays = weakref.WeakValueDictionary()  # fingerprint -> array
+        self._keys = {}  # id(array) -> (weakref, fingerprint)
+        self._dead = []  # (id, weakref) of freed arrays, removed from _keys later
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(values):
+        """(shape, dtype, hash of the values) of an array"""
+        digest = hashlib.blake2b(ascontiguousarray(values).view('u1'), digest_size=16).digest()
+        return (values.shape, values.dtype.str, digest)
+
+    @staticmethod
+    def frozen(values):
+        """
+        values if neither they nor any array they are a view of can
+        be changed (e.g. a read-only memory map), otherwise a
+        read-only copy
+        """
+        base = values
+        while isinstance(base, ndarray):
+            if base.flags.writeable:
+                values = values.copy()
+                values.flags.writeable = False
+                return values
+            base = base.base
+        return values
+
+    def intern(self, values):
+        """
+        The interned array with the same values, shape and dtype as
+        values. If there isn't one, values (or a read-only copy of
+        them) becomes the interned array. Values which aren't NumPy
+        arrays are returned unchanged
+        """
+        if not isinstance(values, ndarray) or values.dtype.hasobject:
+            return values
+        if self.key(values) is not None:
+            return values  # Already interned
+        key = self.fingerprint(values)
+        with self._lock:
+            self._prune()
+            existing = self._arrays.get(key)
+            if existing is not None:
+                return existing
+            values = self.frozen(values)
+            self._arrays[key] = values
+            ident = id(values)
+            dead = self._dead
+            # Called by the garbage collector, possibly while this thread
+            # holds the lock, so only queues the entry for removal
+            ref = weakref.ref(values, lambda ref: dead.append((ident, ref)))
+            self._keys[ident] = (ref, key)
+            return values
+
+    def _prune(self):
+        """
+        Remove entries for freed arrays. Must be called with self._lock held
+        """
+        while self._dead:
+            ident, ref = self._dead.pop()
+            entry = self._keys.get(ident)
+            if entry is not None and entry[0] is ref:
+                del self._keys[ident]
+
+    def key(self, values):
+        """Fingerprint of an interned array, or None if not interned"""
+        with self._lock:
+            self._prune()
+            entry = self._keys.get(id(values))
+        if entry is not None and entry[0]() is values:
+            return entry[1]
+        return None
+
+    def same(self, a, b):
+        """
+        True or False if a and b are interned arrays with the
+        same or different values. None if not known
+        """
+        if a is b:
+            return True
+        ka = self.key(a)
+        kb = self.key(b) if ka is not None else None
+        if kb is None:
+            return None
+        return ka == kb
+
+
+# Interned timebases shared by all sources
+timebases = TimebaseTable()
 
 
 class XPadDataDim:
@@ -30,8 +172,13 @@ class XPadDataDim:
     data     Axis values (NumPy array)
     errl     Low-side error (may be None)
     errh     High-side error (may be None)
+
+    Attributes are stored in __slots__ rather than a dictionary, so
+    subclasses adding attributes should declare their own __slots__
     """
 
+    __slots__ = ("name", "label", "units", "data", "errl", "errh")
+
     def __init__(self, other=None):  # Constructor
         # Instance Variables
         self.name = ""
@@ -66,9 +213,174 @@ class XPadDataDim:
                 "', 'units':'"+self.units+"'} )")
 
     def __eq__(self, other):
-        return ((self.name == other.name) and
-                (self.units == other.units) and
-                all(self.data == other.data))
+        if self is other:
+            return True
+        if (self.name != other.name) or (self.units != other.units):
+            return False
+        # Shared or interned arrays are compared without their values
+        same = timebases.same(self.data, other.data)
+        if same is not None:
+            return same
+        return all(self.data == other.data)
+
+    def __getstate__(self):
+        return slotState(self)
+
+    def __setstate__(self, state):
+        setSlotState(self, state)
+
+
+class UniformDim(XPadDataDim):
+    """
+    Uniformly spaced dimension, stored as start, step and length.
+    The values start + step * index are only made when data is
+    first used, and aren't pickled.
+
+    Assigning data replaces the values, and step becomes None.
+    Use isUniform() to check for a dimension still uniformly spaced
+    """
+
+    __slots__ = ("start", "step", "length", "_data")
+
+    def __init__(self, start=0.0, step=1.0, length=0, other=None):
+        self._data = None
+        XPadDataDim.__init__(self)
+        if other is not None:
+            for name in ["name", "label", "units", "errl", "errh"]:
+                setattr(self, name, getattr(other, name, getattr(self, name)))
+        self.start = start
+        self.step = step
+        self.length = int(length)
+
+    @property
+    def data(self):
+        if self._data is None and self.step is not None:
+            self._data = self.start + self.step * arange(self.length)
+        return self._data
+
+    @data.setter
+    def data(self, values):
+        self._data = values
+        if values is not None:
+            self.step = None
+            self.length = len(values)
+
+    @property
+    def end(self):
+        """The last value"""
+        return self.start + self.step * (self.length - 1)
+
+    def searchsorted(self, value, side='left'):
+        """
+        Index at which value would be inserted, as for
+        numpy.searchsorted on the values, but without making them
+        """
+        if self.step is None or self.step <= 0:
+            return int(searchsorted(asarray(self.data), value, side=side))
+        n = self.length
+        i = floor((value - self.start) / self.step)
+        i = 0 if i < 0 else int(min(i, n))
+        # Correct for rounding, using the same arithmetic as data
+        if side == 'left':
+            while i > 0 and self.start + self.step * (i - 1) >= value:
+                i -= 1
+            while i < n and self.start + self.step * i < value:
+                i += 1
+        else:
+            while i > 0 and self.start + self.step * (i - 1) > value:
+                i -= 1
+            while i < n and self.start + self.step * i <= value:
+                i += 1
+        return i
+
+    def sliced(self, index):
+        """
+        UniformDim of the values selected by a slice index
+        """
+        if self.step is None:
+            dim = XPadDataDim(self)
+            dim.data = self.data[index]
+            return dim
+        start, stop, step = index.indices(self.length)
+        return UniformDim(self.start + self.step * start, self.step * step,
+                          len(range(start, stop, step)), other=self)
+
+    def __eq__(self, other):
+        if isUniform(self) and isUniform(other):
+            return ((self.name == other.name) and
+                    (self.units == other.units) and
+                    (self.start, self.step, self.length) ==
+                    (other.start, other.step, other.length))
+        return XPadDataDim.__eq__(self, other)
+
+    def __getstate__(self):
+        state = slotState(self)
+        if self.step is not None:
+            state['_data'] = None  # Made again when needed
+        return state
+
+
+def isUniform(dim):
+    """
+    True if dim is a UniformDim whose values are still start + step * index
+    """
+    return isinstance(dim, UniformDim) and dim.step is not None
+
+
+def timeValues(item):
+    """
+    The time values of an item: item.time if set, otherwise the values
+    of its time dimension, which for a UniformDim are only made now.
+    Sources leave item.time unset for uniform dimensions, so that the
+    values aren't made unless needed. None if there is no time
+    dimension and the item has more than one dimension
+    """
+    if item.time is not None:
+        return item.time
+    dims = item.dim if isinstance(item.dim, list) else []
+    if 0 <= item.order < len(dims):
+        return dims[item.order].data
+    if len(dims) == 1:
+        return dims[0].data
+    return None
+
+
+def internDims(item):
+    """
+    Replace the values of an item's dimensions with interned arrays,
+    so that items with the same timebase share it. Dimensions which
+    read their values lazily, or are uniform, are left alone
+    """
+    dims = getattr(item, "dim", None)
+    for dim in dims if isinstance(dims, list) else []:
+        if type(dim) is not XPadDataDim:
+            continue
+        values = dim.data
+        interned = timebases.intern(values)
+        if interned is not values:
+            dim.data = interned
+            if item.time is values:
+                item.time = interned
+    if getattr(item, "time", None) is None:
+        return item
+    order = getattr(item, "order", -1)
+    if isinstance(dims, list) and 0 <= order < len(dims) and \
+       type(dims[order]) is not XPadDataDim:
+        # Time is the dimension's own values, not a copy to intern
+        return item
+    item.time = timebases.intern(item.time)
+    return item
+
+
+def copyDim(dim):
+    """
+    Copy of a dimension, keeping uniform dimensions uniform
+    """
+    if isUniform(dim):
+        copy = UniformDim(dim.start, dim.step, dim.length, other=dim)
+        copy._data = dim._data
+        return copy
+    return XPadDataDim(dim)
 
 
 class XPadDataItem:
@@ -92,9 +404,15 @@ class XPadDataItem:
       - errh   High-side error (may be None)
     order   Index of time dimension
     time    A shortcut to the time data (dim[order].data). May be None
+    comment Comment set by the user. Not set until then
 
+    Attributes are stored in __slots__ rather than a dictionary.
+    Catalogs of variables without data use XPadVarInfo instead
     """
 
+    __slots__ = ("name", "source", "label", "units", "desc", "data",
+                 "errl", "errh", "rank", "dim", "order", "time", "comment")
+
     def __init__(self, other=None):  # Constructor
         # Instance Variables
         self.name   = ""
@@ -108,7 +426,7 @@ class XPadDataItem:
         self.rank   = None
         self.dim    = XPadDataDim()             # A list of dimensions
         self.order  = -1             # Index of time dimension
-        self.time   = None           # A shortcut to the time data (dim[order].data). May be None
+        self.time   = None           # A shortcut to the time data (dim[order].data). May be None, see timeValues
 
         if other is not None:
             if hasattr(other, "data"):
@@ -124,7 +442,7 @@ class XPadDataItem:
                 if self.name == "":
                     self.name = other.label
                 try:
-                    self.dim = [XPadDataDim(dim) for
+                    self.dim = [copyDim(dim) for
                                 dim in other.dim]
                 except AttributeError:
                     pass
@@ -133,6 +451,12 @@ class XPadDataItem:
                 self.data = other
                 self.name = str(other)
 
+    def __getstate__(self):
+        return slotState(self)
+
+    def __setstate__(self, state):
+        setSlotState(self, state)
+
     # def __coerce__(self, other):
     #    # Convert other to an XPadDataItem and return
     #    item = XPadDataItem
@@ -405,6 +729,145 @@ class XPadDataItem:
         return item
 
 
+class XPadVarInfo:
+    """
+    Description of a variable in a source's catalog, without data.
+    Much smaller than an XPadDataItem, for sources with many variables
+
+    name, source, label, units, desc   As for XPadDataItem
+    dim     Sequence of dimensions (XPadDataDim objects). May be empty
+    """
+
+    __slots__ = ("name", "source", "label", "units", "desc", "dim")
+
+    def __init__(self, name="", source="", label="", units="", desc="", dim=()):
+        self.name   = name
+        self.source = source
+        self.label  = label
+        self.units  = units
+        self.desc   = desc
+        self.dim    = dim
+
+    def __str__(self):
+        s = self.name + "("+self.units+")"
+        if len(self.dim) > 0:
+            s += " [" + ",".join([str(d) for d in self.dim]) + "]"
+        return s
+
+    def __repr__(self):
+        return ("XPadVarInfo( {'name':'"+self.name +
+                "', 'source':'"+str(self.source) +
+                "', 'label':'"+self.label +
+                "', 'units':'"+self.units +
+                "', 'desc':'"+self.desc+"'} )")
+
+    def __getstate__(self):
+        return slotState(self)
+
+    def __setstate__(self, state):
+        setSlotState(self, state)
+
+
+class XPadDataInfo:
+    """
+    Size and type of a data item, found without reading the data
+
+    shape    Tuple of dimension sizes. () for a scalar
+    dtype    NumPy dtype of the data, or None if not known
+    trange   (min, max) of the time dimension, or None if not known
+    nbytes   Estimated size of the data in bytes. If not given, this is
+             calculated from the shape, assuming 8 bytes if no dtype
+    """
+
+    def __init__(self, shape=(), dtype=None, trange=None, nbytes=None):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = npdtype(dtype) if dtype is not None else None
+        self.trange = trange
+        if nbytes is None:
+            itemsize = self.dtype.itemsize if self.dtype is not None else 8
+            nbytes = int(prod(self.shape, dtype=int)) * itemsize
+        self.nbytes = nbytes
+
+    def __repr__(self):
+        return "XPadDataInfo(shape={}, dtype={}, trange={}, nbytes={})".format(
+            self.shape, self.dtype, self.trange, self.nbytes)
+
+
+def dataInfo(item):
+    """
+    XPadDataInfo describing an existing data item
+    """
+    data = asarray(item.data)
+    trange = None
+    dims = getattr(item, "dim", None)
+    if dims and data.ndim > 0:
+        order = getattr(item, "order", 0)
+        axis = order if 0 <= order < len(dims) else 0
+        if isUniform(dims[axis]):
+            if dims[axis].length > 0:
+                trange = (dims[axis].start, dims[axis].end)
+        else:
+            time = getattr(dims[axis], "data", None)
+            if time is not None and len(time) > 0:
+                trange = (time[0], time[-1])
+    return XPadDataInfo(data.shape, data.dtype, trange, data.nbytes)
+
+
+def subset(item, trange=None, npoints=None):
+    """
+    Select part of a data item along its time dimension
+    (dim[order], or the first dimension if order is not set)
+
+    trange    Optional (min, max) range of times to keep
+    npoints   Optional maximum number of points. Data is strided to fit
+
+    Returns a new XPadDataItem, sharing data with item where possible
+    """
+    if trange is None and npoints is None:
+        return item
+    if not item.dim:
+        return item  # Scalar
+    axis = item.order if 0 <= item.order < len(item.dim) else 0
+    timedim = item.dim[axis]
+    if isUniform(timedim):
+        # Found from start and step, without making the values
+        n = timedim.length
+        find = timedim.searchsorted
+    else:
+        time = asarray(timedim.data)
+        n = len(time)
+
+        def find(value, side):
+            return int(searchsorted(time, value, side=side))
+
+    start, stop = 0, n
+    if trange is not None:
+        start = find(trange[0], side='left')
+        stop = find(trange[1], side='right')
+        if stop <= start:
+            raise ValueError("No data in range {} to {}".format(*trange))
+    step = 1
+    if npoints is not None and npoints > 0 and stop - start > npoints:
+        step = int(ceil((stop - start) / float(npoints)))
+    index = (slice(None),) * axis + (slice(start, stop, step),)
+
+    result = XPadDataItem(item)
+    result.data = asarray(item.data)[index]
+    for name in ["errl", "errh"]:
+        err = getattr(item, name)
+        if err is not None and getattr(err, "shape", None) == item.data.shape:
+            setattr(result, name, err[index])
+    if isUniform(timedim):
+        dim = timedim.sliced(slice(start, stop, step))
+    else:
+        dim = XPadDataDim(timedim)
+        dim.data = time[start:stop:step]
+    result.dim[axis] = dim
+    if item.time is not None:
+        result.time = None if isUniform(dim) else dim.data
+    return result
+
+
 def chop(item):
     """
     Selects a range of indices
@@ -0,0 +1,777 @@
+"""
+Concurrent reading of data items from sources
+
+A batch of (source, name, shot) requests is run on a bounded pool of
+worker threads, so that slow network reads overlap rather than
+running one after another.
+
+"""
+
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import copy
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .pyxpad_utils import XPadDataItem, dataInfo, internDims
+
+
+def readKey(source, name, shot):
+    """
+    Key identifying the data which source.read(name, shot) returns.
+    Sources can define readKey(name, shot) so that different source
+    objects reading the same data share reads, or return None if
+    reads should never be shared. Otherwise the key is the source
+    object, name and shot.
+    """
+    try:
+        return source.readKey(name, shot)
+    except AttributeError:
+        return (source, str(name).strip(), str(shot).strip())
+
+
+def keepsResults(source):
+    """
+    True if results read from source can be kept for later reads.
+    Only sources defining readKey, which identifies the version of
+    the data (e.g. by file modification times), and which haven't
+    turned off 'Cache' in their config
+    """
+    if getattr(source, "readKey", None) is None:
+        return False
+    return getattr(source, "config", {}).get('Cache', True)
+
+
+def accepts(source, option):
+    """
+    True if source.read accepts the keyword argument option,
+    e.g. "npoints" or "trange"
+    """
+    try:
+        params = inspect.signature(source.read).parameters
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return option in params
+
+
+def intern(item):
+    """
+    Share the dimension arrays of a new item with any other
+    items read with the same timebase
+    """
+    if isinstance(item, XPadDataItem):
+        internDims(item)
+    return item
+
+
+def freeze(item):
+    """
+    Make the data arrays of an item read-only, since they are
+    shared with other reads. Returns the item
+    """
+    for name in ["data", "errl", "errh"]:
+        values = getattr(item, name, None)
+        if isinstance(values, np.ndarray):
+            values.setflags(write=False)
+    return item
+
+
+def share(item):
+    """
+    A new item sharing the data arrays of item, so that
+    changes to names or dimensions don't affect the original
+    """
+    if isinstance(item, XPadDataItem):
+        try:
+            return XPadDataItem(item)
+        except TypeError:
+            pass  # dim not a list
+    return copy.copy(item)
+
+
+class ReadCoalescer:
+    """
+    Shares reads of the same data between requests
+
+    If a read is requested while an identical read is in progress,
+    it waits for that read instead of starting another. Recent
+    results are kept, up to maxbytes in total, so that repeated
+    reads return straight away. All items returned for the same
+    read share the same data arrays, which are made read-only so
+    that changing one item can't change the others. Copy the data
+    to change it in place.
+
+    Results are only kept for sources where keepsResults() is true,
+    so that changing data isn't read stale.
+    """
+
+    def __init__(self, maxbytes=256 * 1024 * 1024):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._inflight = {}  # key -> Future
+        self._recent = OrderedDict()  # key -> (item, nbytes), oldest first
+        self._lock = threading.Lock()
+
+    def read(self, source, name, shot, **options):
+        """
+        Read source.read(name, shot, **options), sharing with any
+        identical reads
+        """
+        key = readKey(source, name, shot)
+        if key is None:
+            return intern(source.read(name, shot, **options))
+        if options:
+            key = key + tuple(sorted(options.items()))
+            try:
+                hash(key)
+            except TypeError:
+                # e.g. index ranges given as lists
+                return intern(source.read(name, shot, **options))
+        keep = keepsResults(source)
+
+        with self._lock:
+            if keep and key in self._recent:
+                self._recent.move_to_end(key)
+                return share(self._recent[key][0])
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if not owner:
+            # Wait for the same read in another thread
+            return share(future.result())
+
+        try:
+            item = freeze(intern(source.read(name, shot, **options)))
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if item is not None and keep:
+                self._remember(key, item)
+        if item is not None and keep and not options:
+            probes.remember(key, item)
+        future.set_result(item)
+        return share(item) if item is not None else None
+
+    def _remember(self, key, item):
+        """
+        Keep a result, forgetting the oldest if over maxbytes.
+        Must be called with self._lock held
+        """
+        nbytes = getattr(getattr(item, "data", None), "nbytes", 0)
+        if nbytes > self.maxbytes:
+            return
+        self._recent[key] = (item, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes:
+            _, (_, size) = self._recent.popitem(last=False)
+            self.nbytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self.nbytes = 0
+
+
+class ProbeCache:
+    """
+    Remembers the size and type of data items, so that
+    sources are only probed once for each item
+
+    Items read through a ReadCoalescer are remembered too, so
+    sources which can't be probed are known once read.
+    """
+
+    def __init__(self, maxentries=10000):
+        self.maxentries = maxentries
+        self._infos = OrderedDict()  # key -> XPadDataInfo, oldest first
+        self._lock = threading.Lock()
+
+    def probe(self, source, name, shot):
+        """
+        XPadDataInfo describing what source.read(name, shot) would
+        return, or None if this is not known without reading it.
+        Uses source.probe(name, shot) if the source has one
+        """
+        key = readKey(source, name, shot)
+        if key is not None and keepsResults(source):
+            with self._lock:
+                if key in self._infos:
+                    self._infos.move_to_end(key)
+                    return self._infos[key]
+        sourceProbe = getattr(source, "probe", None)
+        if sourceProbe is None:
+            return None
+        try:
+            info = sourceProbe(name, shot)
+        except Exception:
+            return None  # Found out when read
+        if info is not None and key is not None and keepsResults(source):
+            self._store(key, info)
+        return info
+
+    def remember(self, key, item):
+        """
+        Remember the size of an item which has been read
+        """
+        try:
+            info = dataInfo(item)
+        except Exception:
+            return  # Not an array
+        self._store(key, info)
+
+    def _store(self, key, info):
+        with self._lock:
+            self._infos[key] = info
+            self._infos.move_to_end(key)
+            while len(self._infos) > self.maxentries:
+                self._infos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._infos.clear()
+
+
+# Shared by all reads through ReadRequest
+reads = ReadCoalescer()
+probes = ProbeCache()
+
+
+class ReadRequest:
+    """
+    A single request to read a variable from a source
+
+    source   The data source. Must have a read(name, shot) method
+    name     Name of the variable to read
+    shot     Shot number as a string ("" if not needed)
+    timeout  Seconds to wait for the read, or None to wait forever
+    retries  Number of times to retry after a transient error
+    backoff  Seconds to wait before the first retry. Doubles each time
+    options  Dictionary of extra keyword arguments to read, for sources
+             which accept them (e.g. trange, npoints)
+    future   concurrent.futures.Future for the item read
+    result   The item read (XPadDataItem or equivalent), or None
+    error    sys.exc_info() tuple if the read failed, otherwise None
+    nbytes   Size of the data read, in bytes
+    estimate Estimated size in bytes before reading, or None if not known.
+             Set by probe() or setInfo()
+    info     XPadDataInfo the estimate is from, or None
+    discard  If True, the result is not kept once read
+
+    Reads go through the ReadCoalescer "reads", so identical
+    requests share one read and the same read-only data arrays.
+
+    If timeout and retries are not given, they are taken from the
+    source's config 'Timeout (s)' and 'Retries' if present.
+    Errors which are an instance of one of the source's
+    transientErrors (default OSError) are retried.
+    """
+
+    def __init__(self, source, name, shot, timeout=None, retries=None, backoff=1.0,
+                 options=None):
+        self.source = source
+        self.name = name
+        self.shot = shot
+        self.options = options if options is not None else {}
+        config = getattr(source, "config", {})
+        if timeout is None:
+            timeout = config.get('Timeout (s)', 0)
+        self.timeout = timeout if timeout else None
+        if retries is None:
+            retries = config.get('Retries', 0)
+        self.retries = retries
+        self.backoff = backoff
+        self.result = None
+        self.error = None
+        self.nbytes = 0
+        self.estimate = None
+        self.info = None
+        self.discard = False
+        self.started = None  # Time the read started
+        self.future = Future()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        s = self.name + " from " + self.source.label
+        if self.shot != "":
+            s += " shot = " + self.shot
+        return s
+
+    def probe(self):
+        """
+        Find the size of the data to be read, without reading it.
+        Returns an XPadDataInfo, or None if not known, and sets estimate
+        """
+        return self.setInfo(probes.probe(self.source, self.name, self.shot))
+
+    def setInfo(self, info):
+        """
+        Set the size of the data to be read, e.g. from a probe of the
+        same signal in another shot, and the estimate from it
+        """
+        self.info = info
+        if info is None:
+            self.estimate = None
+            return None
+        nbytes = info.nbytes
+        npoints = self.options.get('npoints')
+        if info.shape and npoints and info.shape[0] > npoints:
+            nbytes = nbytes * npoints // info.shape[0]
+        self.estimate = nbytes
+        return info
+
+    def run(self, stop=None):
+        """
+        Perform the read, retrying if needed, and set the result or error.
+
+        stop  Optional threading.Event which interrupts retries
+        """
+        if self.future.done():
+            return  # Cancelled before starting
+        self.started = time.time()
+        transient = getattr(self.source, "transientErrors", (OSError,))
+        delay = self.backoff
+        attempt = 0
+        while True:
+            try:
+                result = reads.read(self.source, self.name, self.shot, **self.options)
+            except transient:
+                if attempt >= self.retries:
+                    self.finish(error=sys.exc_info())
+                    return
+                attempt += 1
+                if stop is not None:
+                    if stop.wait(delay):
+                        self.cancel()
+                        return
+                else:
+                    time.sleep(delay)
+                delay *= 2
+            except Exception:
+                self.finish(error=sys.exc_info())
+                return
+            else:
+                self.finish(result=result)
+                return
+
+    def finish(self, result=None, error=None):
+        """
+        Set the result or error, unless already finished
+        """
+        with self._lock:
+            if self.future.done():
+                return False  # Cancelled or timed out
+            self.nbytes = getattr(getattr(result, "data", None), "nbytes", 0)
+            if self.discard:
+                result = None
+            self.result = result
+            self.error = error
+            if error is None:
+                self.future.set_result(result)
+            else:
+                self.future.set_exception(error[1])
+            return True
+
+    def cancel(self):
+        with self._lock:
+            return self.future.cancel()
+
+    def checkTimeout(self, now=None):
+        """
+        Fail the request if it has been running longer than the timeout.
+        The read itself can't be interrupted, so its result is discarded.
+        """
+        if self.timeout is None or self.started is None:
+            return
+        if now is None:
+            now = time.time()
+        if now - self.started > self.timeout:
+            try:
+                raise TimeoutError("No response after {} seconds".format(self.timeout))
+            except TimeoutError:
+                self.finish(error=sys.exc_info())
+
+
+class ReadJob:
+    """
+    A batch of read requests, run on a bounded pool of worker threads
+
+    The workers are daemon threads, so a read which has been abandoned
+    after a timeout, but is still waiting for a reply, doesn't stop
+    the program from exiting.
+
+    Results are returned in the order the requests were given, so
+    items from each source keep the order in which they were
+    selected, whichever read finishes first.
+
+    start() returns immediately. Each request's future can be
+    waited on, or the job polled with poll() until done.
+
+    progress   Optional function called as progress(request, ndone, ntotal)
+               after each request finishes. Note that this is called from
+               a worker thread, so must not touch any widgets. Calls are
+               made one at a time, so it need not be thread safe.
+    """
+
+    def __init__(self, requests, max_workers=4, progress=None):
+        self.requests = list(requests)
+        self.max_workers = max(1, int(max_workers))
+        self.progress = progress
+        self.cancelled = False
+        self.ndone = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        Submit all requests to the worker pool. Returns immediately
+
+        Requests with the largest estimated size are started first, so
+        that one large read doesn't hold up the end of the job.
+        """
+        nworkers = min(self.max_workers, max(1, len(self.requests)))
+        for req in self.requests:
+            req.future.add_done_callback(lambda future, req=req: self._finished(req))
+        queue = deque(sorted(self.requests, key=lambda req: -(req.estimate or 0)))
+        for i in range(nworkers):
+            worker = threading.Thread(target=self._work, args=(queue,),
+                                      name="ReadJob worker {}".format(i))
+            worker.daemon = True
+            worker.start()
+        return self
+
+    def _work(self, queue):
+        """
+        Run requests from the queue in a worker thread,
+        which exits once the queue is empty
+        """
+        while True:
+            try:
+                req = queue.popleft()
+            except IndexError:
+                return
+            try:
+                self._run(req)
+            except Exception:
+                # Keep going with the rest of the queue
+                req.finish(error=sys.exc_info())
+
+    def _run(self, req):
+        if self.cancelled:
+            return
+        req.run(self._stop)
+
+    def _finished(self, req):
+        """
+        Called once when each request finishes, fails or is cancelled
+        """
+        with self._lock:
+            self.ndone += 1
+            if self.progress is not None and not self.cancelled:
+                self.progress(req, self.ndone, len(self.requests))
+
+    def futures(self):
+        return [req.future for req in self.requests]
+
+    def cancel(self):
+        """
+        Cancel all requests. Reads already in progress can't be
+        interrupted, but their results are discarded.
+        """
+        self.cancelled = True
+        self._stop.set()
+        for req in self.requests:
+            req.cancel()
+
+    def poll(self):
+        """
+        Check for requests which have timed out.
+        Returns True if the job is done
+        """
+        now = time.time()
+        for req in self.requests:
+            req.checkTimeout(now)
+        return self.done()
+
+    def done(self):
+        """
+        True if all requests have finished, failed or been cancelled
+        """
+        return all(req.future.done() for req in self.requests)
+
+    def wait(self, timeout=None, interval=0.05):
+        """
+        Wait for up to timeout seconds (forever if None) for the
+        job to finish, checking for timeouts. Returns True if done.
+        """
+        end = None if timeout is None else time.time() + timeout
+        while not self.poll():
+            if end is not None and time.time() >= end:
+                return False
+            time.sleep(interval)
+        return True
+
+    def results(self):
+        """
+        List of items successfully read, in request order.
+        Empty if the job was cancelled.
+        """
+        if self.cancelled:
+            return []
+        return [req.result for req in self.requests if req.result is not None]
+
+    def errors(self):
+        """
+        List of requests which failed
+        """
+        return [req for req in self.requests if req.error is not None]
+
+    def missing(self):
+        """
+        List of requests which finished without error, but found no data
+        """
+        return [req for req in self.requests
+                if req.future.done() and not req.future.cancelled()
+                and req.error is None and req.result is None and not req.discard]
+
+    def summary(self):
+        """
+        Lines describing the reads which failed or found no data,
+        grouped by reason, rather than one line per request
+        """
+        groups = OrderedDict()  # reason -> list of requests
+        for req in self.errors():
+            groups.setdefault(str(req.error[1]) or req.error[0].__name__, []).append(req)
+        missing = self.missing()
+        if missing:
+            groups["No data"] = missing
+        if not groups:
+            return []
+
+        nfailed = sum(len(reqs) for reqs in groups.values())
+        lines = ["{} of {} reads failed".format(nfailed, len(self.requests))]
+        for reason, reqs in groups.items():
+            names = sorted(set(req.name for req in reqs))
+            shots = sorted(set(req.shot for req in reqs if req.shot != ""),
+                           key=lambda shot: (len(shot), shot))
+            line = "  {}: {} ({}".format(reason, len(reqs), listSummary(names))
+            if shots:
+                line += "; shots " + listSummary(shots)
+            lines.append(line + ")")
+        return lines
+
+
+def estimate(requests, maxprobes=64, max_workers=4):
+    """
+    Estimate the size of each request, probing at most maxprobes of
+    them, spread over the list, on up to max_workers threads. Requests
+    not probed get the size of a probed request for the same signal
+    from the same source, if there is one. Returns the total estimate
+    """
+    requests = list(requests)
+    # One request for each signal, then others spread over the list
+    sample = OrderedDict()
+    for req in requests:
+        if len(sample) >= maxprobes:
+            break
+        sample.setdefault((id(req.source), req.name), req)
+    sample = list(sample.values())
+    spare = maxprobes - len(sample)
+    if spare > 0:
+        chosen = set(map(id, sample))
+        others = [req for req in requests if id(req) not in chosen]
+        step = max(1, -(-len(others) // spare))
+        sample += others[::step]
+    if sample:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sample)))) as executor:
+            list(executor.map(lambda req: req.probe(), sample))
+    known = {}
+    for req in sample:
+        if req.info is not None:
+            known.setdefault((id(req.source), req.name), req.info)
+    for req in requests:
+        if req.info is None:
+            req.setInfo(known.get((id(req.source), req.name)))
+    return sum(req.estimate or 0 for req in requests)
+
+
+def decimate(requests, maxbytes):
+    """
+    Limit the number of points read, so that the total estimated
+    size of the requests is no more than maxbytes. Only requests whose
+    size is known, and whose source accepts npoints, are changed.
+    Requests must have been probed, or given an estimate with
+    setInfo(). Returns the new total estimate
+    """
+    total = sum(req.estimate or 0 for req in requests)
+    if total <= maxbytes:
+        return total
+    scale = maxbytes / float(total)
+    for req in requests:
+        if not req.estimate or not accepts(req.source, "npoints"):
+            continue
+        info = req.info
+        if info is None or not info.shape:
+            continue
+        npoints = min(info.shape[0], req.options.get('npoints') or info.shape[0])
+        req.options['npoints'] = max(1, int(npoints * scale))
+        req.setInfo(info)
+    return sum(req.estimate or 0 for req in requests)
+
+
+def parseShots(text):
+    """
+    List of shots (as strings) from comma separated text.
+    Each item can be:
+
+      29000           A single shot
+      29000-29200     A range of shots, including both ends
+      29000-29200:5   Every fifth shot in a range
+      @shots.txt      Shots listed in a file, separated by commas,
+                      spaces or new lines. Lines starting '#' are ignored
+
+    Other items (e.g. for sources without shot numbers) are kept
+    as they are. Repeated shots are removed. Empty text gives [""].
+    Raises ValueError if a range or file is not valid
+    """
+    shots = []
+    for item in text.split(','):
+        item = item.strip()
+        if item.startswith('@'):
+            shots += shotsFromFile(item[1:].strip())
+            continue
+        match = re.match(r"^(\d+)\s*-\s*(\d+)\s*(?::\s*(\d+))?$", item)
+        if match is None:
+            shots.append(item)
+            continue
+        first, last = int(match.group(1)), int(match.group(2))
+        stride = int(match.group(3)) if match.group(3) else 1
+        if last < first or stride < 1:
+            raise ValueError("Invalid shot range '{}'".format(item))
+        shots += [str(shot) for shot in range(first, last + 1, stride)]
+
+    # Remove repeats, keeping the order
+    seen = set()
+    unique = []
+    for shot in shots:
+        if shot in seen:
+            continue
+        seen.add(shot)
+        unique.append(shot)
+    if len(unique) > 1 and "" in seen:
+        unique.remove("")  # Trailing comma
+    return unique if unique else [""]
+
+
+def shotsFromFile(filename):
+    """
+    List of shots in a file. See parseShots
+    """
+    try:
+        with open(os.path.expanduser(filename), 'r') as f:
+            lines = [line.split('#')[0] for line in f]
+    except (OSError, IOError) as e:
+        raise ValueError("Cannot read shots from '{}': {}".format(filename, e))
+    items = " ".join(lines).replace(',', ' ').split()
+    if len(items) == 0:
+        return []
+    return parseShots(",".join(items))
+
+
+def listSummary(values, maxshown=5):
+    """
+    Short comma separated list, with the number of others if too long
+    """
+    values = list(values)
+    text = ", ".join(values[:maxshown])
+    if len(values) > maxshown:
+        text += " and {} more".format(len(values) - maxshown)
+    return text
+
+
+def neighbouringShots(requests):
+    """
+    Requests for the same signals in the shots either side of
+    those requested. Requests without a shot number are ignored
+    """
+    shots = set(req.shot.strip() for req in requests)
+    neighbours = []
+    seen = set()
+    for req in requests:
+        if not req.shot.strip().isdigit():
+            continue
+        for shot in [int(req.shot) + 1, int(req.shot) - 1]:
+            shot = str(shot)
+            key = (id(req.source), req.name, shot)
+            if shot in shots or key in seen:
+                continue
+            seen.add(key)
+            neighbours.append(ReadRequest(req.source, req.name, shot))
+    return neighbours
+
+
+class PrefetchJob(ReadJob):
+    """
+    A ReadJob whose results are thrown away, used to fill the
+    sources' caches. Reads are spread out so that on average no
+    more than bandwidth bytes per second are read.
+    """
+
+    def __init__(self, requests, max_workers=2, bandwidth=None):
+        super().__init__(requests, max_workers=max_workers)
+        self.bandwidth = bandwidth
+        self.nbytes = 0
+        self._starttime = time.time()
+        for req in self.requests:
+            req.discard = True  # Only wanted in the cache
+
+    def _run(self, req):
+        if self.cancelled:
+            return
+        req.run(self._stop)
+        if not self.bandwidth:
+            return
+        with self._lock:
+            self.nbytes += req.nbytes
+            delay = self.nbytes / float(self.bandwidth) - (time.time() - self._starttime)
+        if delay > 0:
+            self._stop.wait(delay)  # Returns early if cancelled
+
+
+class Prefetcher:
+    """
+    Reads data in the background, ahead of it being needed.
+    Only one batch is prefetched at a time; starting a new batch
+    cancels the previous one.
+
+    max_workers   Maximum number of reads in progress at once
+    bandwidth     Maximum average bytes per second, or None for no limit
+    """
+
+    def __init__(self, max_workers=2, bandwidth=None):
+        self.max_workers = max_workers
+        self.bandwidth = bandwidth
+        self.job = None
+
+    def start(self, requests):
+        self.cancel()
+        if len(requests) == 0:
+            return
+        self.job = PrefetchJob(requests, max_workers=self.max_workers,
+                               bandwidth=self.bandwidth).start()
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
@@ -22,9 +22,16 @@
 # You should have received a copy of the GNU General Public License
 # along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
+import pickle
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
 
-from .pyxpad_utils import XPadDataItem, XPadDataDim
+from .pyxpad_utils import XPadDataItem, XPadDataDim, XPadVarInfo, subset, dataInfo
+from .cache import cache_dir, getCache
 
 import importlib
 
@@ -44,17 +51,296 @@ for idam_module in possible_idam_modules:
 if not gotidam:
     print("Warning: UDA/IDAM library not found. Cannot read data")
 
+# Errors worth retrying, since they may be due to the network or server
+transientErrors = (OSError,)
+if gotidam and hasattr(idam, "ProtocolException"):
+    transientErrors += (idam.ProtocolException,)
+
+
+class ClientPool:
+    """
+    A pool of UDA/IDAM clients, shared between threads
+
+    Clients are borrowed for each read and then returned, so that
+    connections are reused. A client is not reused if a read with it
+    failed with a transient (e.g. network) error, or if it has been
+    idle for longer than maxidle seconds, in case the server has
+    dropped the connection.
+
+    Usage:
+
+      with pool.client(host, port) as client:
+          data = client.get(name, shot)
+
+    clientClass   Class used to create clients. Default (None) is the
+                  UDA/IDAM library's Client. See fakeuda for a stand-in
+    """
+
+    # Creating a client uses class-level settings, so only one
+    # client can be created at a time
+    _createLock = threading.Lock()
+
+    def __init__(self, maxidle=300., maxclients=8, clientClass=None):
+        self.clientClass = clientClass
+        self.maxidle = maxidle
+        self.maxclients = maxclients  # Idle clients kept per server
+        self._idle = {}  # (host, port) -> list of (client, last used time)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self, host, port):
+        key = (host, port)
+        client = self._take(key)
+        try:
+            yield client
+        except transientErrors:
+            # Connection may be broken, so don't reuse this client
+            raise
+        except Exception:
+            # e.g. signal not found. Client still works
+            self._put(key, client)
+            raise
+        else:
+            self._put(key, client)
+
+    def _take(self, key):
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                client, lastused = idle.pop()  # Most recently used
+                if now - lastused < self.maxidle:
+                    return client
+                # Too old; drop and try the next
+        clientClass = self.clientClass
+        if clientClass is None:
+            if not gotidam:
+                raise ImportError("No IDAM library available")
+            clientClass = idam.Client
+        with self._createLock:
+            clientClass.server, clientClass.port = key
+            return clientClass()
+
+    def _put(self, key, client):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxclients:
+                idle.append((client, time.time()))
+
+    def clear(self):
+        """
+        Drop all idle clients
+        """
+        with self._lock:
+            self._idle = {}
+
+
+def readItemFile(path):
+    """
+    Read an XPAD .item file
+
+    Returns (label, entries) where entries is a list of (name, description)
+    """
+    with open(path, 'r') as f:
+        label = f.readline().strip()  # First line is the label
+        nitems = int((f.readline().split('$', 1))[0].strip())  # Number of items
+        entries = []
+        for i in range(nitems):
+            line = f.readline()
+            # Split at '$'
+            s = line.split('$', 1)
+            name = s[0].strip()
+            if len(name) == 0:
+                continue
+            try:
+                desc = s[1].strip()
+            except:
+                desc = ""
+            entries.append((name, desc))
+    return label, entries
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class XPadIndex:
+    """
+    Index of the directories and item files in an XPAD tree, saved
+    between sessions so that the tree doesn't need to be re-read
+
+    Directory listings are re-read only if the directory's modification
+    time changes, and item files only if the file's modification time
+    changes. Entries below a file or directory which has been removed
+    are dropped when its parent directory is re-read.
+    """
+
+    def __init__(self, root):
+        self.filename = os.path.join(
+            cache_dir, "xpad-index",
+            hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest() + ".pkl")
+        self.dirs = {}   # path -> (mtime, title mtime, title, subdirs, items)
+        self.items = {}  # path -> (mtime, label, entries)
+        self.changed = False
+        try:
+            with open(self.filename, 'rb') as f:
+                self.dirs, self.items = pickle.load(f)
+        except Exception:
+            # No index, or not readable. Start again
+            self.changed = True
+        self._depth = 0
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager which saves the index when the outermost
+        batch finishes
+        """
+        self._depth += 1
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                self.save()
+
+    def listDir(self, path):
+        """
+        Returns (title, subdirs, items) for a directory.
+        title is None if there is no 'title' file
+        """
+        entry = self.dirs.get(path)
+        dirtime = mtime(path)
+        if entry is not None and entry[0] == dirtime:
+            titletime = mtime(os.path.join(path, 'title')) if entry[2] is not None else None
+            if titletime == entry[1]:
+                return entry[2:]
+
+        # List directory
+        ls = os.listdir(path)
+
+        # Check if a name is supplied
+        title = None
+        titletime = None
+        if 'title' in ls:
+            # Read file to get the label
+            titlefile = os.path.join(path, 'title')
+            titletime = mtime(titlefile)
+            with open(titlefile, 'r') as f:
+                title = f.readline().strip()
+
+        # Each directory which isn't hidden
+        subdirs = [name for name in ls
+                   if os.path.isdir(os.path.join(path, name)) and name[0] != '.']
+        items = [name for name in ls
+                 if (os.path.splitext(name)[1] == ".item") and
+                 os.path.isfile(os.path.join(path, name))]
+
+        if entry is not None:
+            # Forget anything which has been removed
+            for name in set(entry[3] + entry[4]) - set(subdirs + items):
+                self.forget(os.path.join(path, name))
+
+        self.dirs[path] = (dirtime, titletime, title, subdirs, items)
+        self.changed = True
+        return title, subdirs, items
+
+    def readItem(self, path):
+        """
+        Returns (label, entries) for an item file. See readItemFile
+        """
+        entry = self.items.get(path)
+        itemtime = mtime(path)
+        if entry is not None and entry[0] == itemtime:
+            return entry[1:]
+        label, entries = readItemFile(path)
+        self.items[path] = (itemtime, label, entries)
+        self.changed = True
+        return label, entries
+
+    def forget(self, path):
+        """
+        Remove a file or directory and everything below it
+        """
+        prefix = os.path.join(path, '')
+        for table in [self.dirs, self.items]:
+            for p in list(table.keys()):
+                if p == path or p.startswith(prefix):
+                    del table[p]
+        self.changed = True
+
+    def save(self):
+        """
+        Write the index to file, if anything has changed
+        """
+        if not self.changed:
+            return
+        tmpname = self.filename + ".{}.tmp".format(os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(tmpname, 'wb') as f:
+                pickle.dump((self.dirs, self.items), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self.filename)
+            self.changed = False
+        except (OSError, IOError):
+            # Index is only an optimisation
+            pass
+
+
+class VariablesView(Mapping):
+    """
+    Read-only dictionary of the variables in all item files below
+    a directory. Variables are looked up in a table of the item file
+    holding each name, rather than being copied into every directory.
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def __getitem__(self, name):
+        leaf = self.source.lookup().get(name)
+        if leaf is None:
+            raise KeyError(name)
+        return leaf.variables[name]
+
+    def __iter__(self):
+        for leaf in self.source.leaves():
+            for name in leaf.variables:
+                yield name
+
+    def __len__(self):
+        return sum(len(leaf.variables) for leaf in self.source.leaves())
+
 
 class XPadSource:
-    def __init__(self, path, parent=None):
+    """
+    A tree of XPAD directories and item files, read using UDA/IDAM
+
+    The tree is read lazily: the children of a directory are only
+    found when first needed, and the variables in a directory are a
+    view of the item files below it.
+    """
+
+    _children = None   # Child sources. None until needed
+    _variables = None  # Variables in an item file. None until needed
+    _entries = None    # (name, description) pairs from item file
+    _index = None      # XPadIndex shared by the tree
+    _lookup = None     # Dictionary of name -> item file source below
+    path = None
+
+    transientErrors = transientErrors  # Read errors which are retried
+
+    def __init__(self, path, parent=None, index=None):
 
         # Convert path to string, strip NULL chars
         path = str(path)
 
+        self.path = path
         self.label = os.path.basename(os.path.normpath(path))
         self.dimensions = {}
-        self.varNames = []
-        self.variables = {}
 
         self.parent = parent
 
@@ -63,71 +349,144 @@ class XPadSource:
             self.config = {'Host': 'mast.fusion.org.uk',
                            'Port': 56565,
                            'verbose': True,
-                           'debug': False}
+                           'debug': False,
+                           'Cache': True,          # Keep a local copy of data read
+                           'Cache size (MB)': 2048,
+                           'Prefetch': False,      # Read likely next shots in background
+                           'Timeout (s)': 60,      # 0 to wait forever
+                           'Retries': 2}
         else:
             self.config = parent.config
 
-        if os.path.isdir(path):
-            # List directory
-            ls = os.listdir(path)
-
-            # Check if a name is supplied
-            if 'title' in ls:
-                # Read file to get the label
-                f = open(os.path.join(path, 'title'), 'r')
-                self.label = f.readline().strip()
-                f.close()
-
-            # Create a child for each subdirectory
-            self.children = [XPadSource(os.path.join(path, name), parent=self)  # Create child
-                             for name in ls
-                             # For each directory which isn't hidden
-                             if os.path.isdir(os.path.join(path, name)) and name[0] != '.']
-
-            # Find items
-            for name in ls:
-                if os.path.isfile(os.path.join(path, name)) and (os.path.splitext(name)[1] == ".item"):
-                    self.children.append(XPadSource(os.path.join(path, name), parent=self))
-        else:
-            # Given an item file to read
-            f = open(path, 'r')
-            self.label = f.readline().strip()  # First line is the label
-            nitems = int((f.readline().split('$', 1))[0].strip())  # Number of items
-            for i in range(nitems):
-                line = f.readline()
-                # Split at '$'
-                s = line.split('$', 1)
-                name = s[0].strip()
-                if len(name) == 0:
-                    continue
-                try:
-                    desc = s[1].strip()
-                except:
-                    desc = ""
-                item = XPadDataItem()
-                item.name = name
-                item.label = item.desc = desc
-                item.source = path
-                self.variables[name] = item
-                self.varNames.append(name)
-
-            if parent is not None:
-                parent.addVariables(self.variables)
-            f.close()
-
-    def addVariables(self, vardict):
-        # Add to dictionary of variables and list of names
-        for name, var in vardict.items():
-            self.variables[name] = var
-            self.varNames.append(name)
-
-        if self.parent is not None:
-            self.parent.addVariables(vardict)  # Variables go from children up to parent
-
-    def read(self, name, shot):
-        """ Read data from IDAM """
-        if not gotidam:
-            raise ImportError("No IDAM library available")
+        # The root source reads the saved index, shared with all children
+        if index is None:
+            index = XPadIndex(path)
+        self._index = index
+
+        with index.batch():
+            self.isdir = os.path.isdir(path)
+            if self.isdir:
+                title, _, _ = index.listDir(path)
+                if title is not None:
+                    self.label = title
+            else:
+                # Given an item file to read
+                self.label, self._entries = index.readItem(path)
+
+    def getIndex(self):
+        if self._index is None:
+            if self.parent is not None:
+                self._index = self.parent.getIndex()
+            else:
+                self._index = XPadIndex(self.path)
+        return self._index
+
+    @property
+    def children(self):
+        """
+        List of subdirectories and item files. Only for directories
+        """
+        if not self.isdir:
+            raise AttributeError("Item file has no children")
+        if self._children is None:
+            index = self.getIndex()
+            with index.batch():
+                _, subdirs, items = index.listDir(self.path)
+                # Create a child for each subdirectory, then each item
+                self._children = [XPadSource(os.path.join(self.path, name),
+                                             parent=self, index=index)
+                                  for name in subdirs + items]
+        return self._children
+
+    def hasChildren(self):
+        """
+        True if this source may have children, without finding them
+        """
+        return self.isdir
+
+    @property
+    def variables(self):
+        """
+        Dictionary of XPadVarInfo objects
+        """
+        if self.isdir:
+            return VariablesView(self)
+        if self._variables is None:
+            variables = {}
+            for name, desc in self._entries:
+                variables[name] = XPadVarInfo(name, self.path, desc, desc=desc)
+            self._variables = variables
+        return self._variables
+
+    @property
+    def varNames(self):
+        """
+        List of variable names
+        """
+        if self.isdir:
+            return [name for leaf in self.leaves() for name in leaf.variables]
+        return list(self.variables.keys())
+
+    def leaves(self):
+        """
+        List of all item files at or below this source
+        """
+        if not self.isdir:
+            return [self]
+        return [leaf for child in self.children for leaf in child.leaves()]
+
+    def clientPool(self):
+        """
+        The ClientPool shared by the whole tree, owned by the root
+        """
+        root = self.root()
+        pool = root.__dict__.get('_clients')
+        if pool is None:
+            pool = root.__dict__.setdefault('_clients', ClientPool())
+        return pool
+
+    def root(self):
+        source = self
+        while source.parent is not None:
+            source = source.parent
+        return source
+
+    def lookup(self):
+        """
+        Dictionary mapping variable names to the item file below this
+        source containing them. Built when first needed. Where item
+        files share a name, the last one is used
+        """
+        if self._lookup is None:
+            lookup = {}
+            for leaf in self.leaves():
+                for name in leaf.variables:
+                    lookup[name] = leaf
+            self._lookup = lookup
+        return self._lookup
+
+    def readKey(self, name, shot):
+        """
+        Identifies the data read, so that identical reads from any
+        source in any tree can be shared. Only reads of a given shot
+        are shared, since others (e.g. "lastshot") may change
+        """
+        shot = str(shot).strip()
+        if not shot.isdigit():
+            return None
+        return (self.config['Host'], self.config['Port'], str(name).strip(), shot)
+
+    def read(self, name, shot, trange=None, npoints=None):
+        """
+        Read data from IDAM
+
+        trange    Optional (min, max) range of times to read
+        npoints   Optional maximum number of points. Data is strided to fit
+
+        If the client can select part of a signal (has a true canSubset
+        attribute), then only the part needed is requested. Otherwise,
+        the whole signal is read (or taken from the cache) and cut down
+        """
         try:
             if isinstance(name, unicode):
                 name = name.encode('utf-8')
@@ -135,16 +494,26 @@ class XPadSource:
             pass
         name = str(name).strip()
         shot = str(shot).strip()
+        partial = (trange is not None) or (npoints is not None)
 
-        # Start client
-        if not hasattr(self, "client"):
-            # Set configuration
-            idam.Client.server = self.config['Host']
-            idam.Client.port = self.config['Port']
-            self.client = idam.Client()
+        # Check the local cache. Only data for a given shot number is
+        # cached, since other requests (e.g. "lastshot") may change
+        cache = None
+        if self.config.get('Cache', True) and shot.isdigit():
+            cache = getCache(maxsize=self.config.get('Cache size (MB)', 2048))
+            key = (self.config['Host'], self.config['Port'], name, shot)
+            item = cache.get(key)
+            if item is not None:
+                return subset(item, trange, npoints)
 
-        # Read data
-        data = self.client.get(name, shot)
+        # Borrow a client from the tree's pool, and read data
+        with self.clientPool().client(self.config['Host'], self.config['Port']) as client:
+            if partial and getattr(client, "canSubset", False):
+                data = client.get(name, shot, trange=trange, npoints=npoints)
+                cache = None  # Only cache whole signals
+                partial = False
+            else:
+                data = client.get(name, shot)
 
         if hasattr(data, "dims") and not hasattr(data, "dim"):
             data.dim = data.dims
@@ -157,17 +526,65 @@ class XPadSource:
             # Probably IDAM has set something to be read-only property
             pass
 
-        return XPadDataItem(data)
+        item = XPadDataItem(data)
+        if cache is not None:
+            cache.put(key, item)
+            try:
+                # Kept separately, so probe() doesn't load the data
+                cache.put(('info',) + key, dataInfo(item))
+            except Exception:
+                pass
+        if partial:
+            item = subset(item, trange, npoints)
+        return item
 
-    def size(self, name):
-        pass
+    def probe(self, name, shot):
+        """
+        Size and type of a signal, without reading it.
+
+        The server can't be asked for this without reading the data,
+        so this is only known for signals in the local cache.
+        Returns an XPadDataInfo, or None if not known.
+        """
+        key = self.readKey(name, shot)
+        if key is None or not self.config.get('Cache', True):
+            return None
+        cache = getCache(maxsize=self.config.get('Cache size (MB)', 2048))
+        return cache.get(('info',) + key)
+
+    def size(self, name, shot=""):
+        """
+        List of dimension sizes for a signal, or None if not known
+        """
+        info = self.probe(name, shot)
+        if info is None:
+            return None
+        return list(info.shape)
 
     def __getstate__(self):
-        # We need to remove the IDAM client in order to pickle
-        # instances of this class
-        if hasattr(self, "client"):
-            state = self.__dict__.copy()
-            del state['client']
-            return state
-        else:
-            return self.__dict__
+        # We need to remove the IDAM clients in order to pickle
+        # instances of this class. Index and lookup tables are rebuilt
+        state = self.__dict__.copy()
+        for name in ['client', '_threadlocal', '_clients', '_index', '_lookup', '_variables']:
+            if name in state:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        if 'isdir' not in state:
+            # Saved before the tree was read lazily
+            state['isdir'] = 'children' in state
+            if state['isdir']:
+                state['_children'] = state.pop('children')
+                del state['variables']
+            else:
+                # Keep the item file's entries, from which
+                # variables are made again after saving
+                variables = state.pop('variables')
+                state['_entries'] = [(name, variables[name].desc)
+                                     for name in state['varNames']
+                                     if name in variables]
+                if variables and state.get('path') is None:
+                    state['path'] = next(iter(variables.values())).source
+            del state['varNames']
+        self.__dict__.update(state)
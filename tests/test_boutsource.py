@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("boutdata")
+netCDF4 = pytest.importorskip("netCDF4")
+
+from pyxpad import boutsource
+from pyxpad.boutsource import BoutDataSource
+
+NXPE, MXSUB, MXG, MYSUB, MZ, NT = 2, 4, 1, 3, 2, 5
+
+
+def expected(t, x, y, z):
+    return 1000. * t + 100. * x + 10. * y + z
+
+
+def write_run(path):
+    """Dump files for a run on NXPE processors in X"""
+    t, y, z = np.meshgrid(np.arange(NT), np.arange(MYSUB), np.arange(MZ), indexing='ij')
+    for proc in range(NXPE):
+        with netCDF4.Dataset(str(path / "BOUT.dmp.{}.nc".format(proc)), 'w') as f:
+            for dim, n in [('t', None), ('x', MXSUB + 2 * MXG), ('y', MYSUB), ('z', MZ)]:
+                f.createDimension(dim, n)
+            for name, value in [('NXPE', NXPE), ('NYPE', 1), ('MXSUB', MXSUB),
+                                ('MYSUB', MYSUB), ('MXG', MXG), ('MYG', 0), ('MZ', MZ)]:
+                f.createVariable(name, 'i4', ())[...] = value
+            f.createVariable('BOUT_VERSION', 'f8', ())[...] = 4.3
+            f.createVariable('t_array', 'f8', ('t',))[:] = 0.1 * np.arange(NT)
+            n = f.createVariable('n', 'f8', ('t', 'x', 'y', 'z'))
+            x = proc * MXSUB + np.arange(MXSUB + 2 * MXG)
+            n[:] = expected(t[:, None], x[None, :, None, None], y[:, None], z[:, None])
+    return BoutDataSource(str(path))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read(tmp_path, workers):
+    source = write_run(tmp_path)
+    source.config['Parallel reads'] = workers
+    nx = NXPE * MXSUB + 2 * MXG
+
+    item = source.read("n", "")
+    assert item.data.shape == (NT, nx, MYSUB, MZ)
+    t, x, y, z = np.meshgrid(np.arange(NT), np.arange(nx), np.arange(MYSUB),
+                             np.arange(MZ), indexing='ij')
+    assert np.array_equal(item.data, expected(t, x, y, z))
+    assert np.allclose(item.time, 0.1 * np.arange(NT))
+
+    item = source.read("n", "", tind=[1, 3], xind=[2, 7])
+    assert item.data.shape == (3, 6, MYSUB, MZ)
+    assert np.array_equal(item.data, expected(t, x, y, z)[1:4, 2:8])
+    assert item.dim[1].start == 2
+
+
+def test_pool_kept_between_reads(tmp_path):
+    source = write_run(tmp_path)
+    source.config['Parallel reads'] = 2
+    source.read("n", "")
+    pool = boutsource._pool
+    assert pool is not None
+    source.read("n", "", xind=[0, 8])
+    assert boutsource._pool is pool
@@ -0,0 +1,31 @@
+import threading
+import time
+
+import numpy as np
+
+from pyxpad.cache import SignalCache
+
+
+def test_put_and_get(tmp_path):
+    cache = SignalCache(str(tmp_path))
+    cache.put(("host", 1, "ip", "29000"), np.arange(10.))
+    assert np.array_equal(cache.get(("host", 1, "ip", "29000")), np.arange(10.))
+    assert cache.get(("host", 1, "ip", "29001")) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = SignalCache(str(tmp_path), maxsize=20000)
+    # Random, so it doesn't compress
+    values = np.random.RandomState(1).standard_normal(1000)
+    for key in range(3):
+        cache.put(key, values)
+        time.sleep(0.01)  # So files are ordered by modification time
+    assert cache.size() <= 20000
+    assert cache.get(2) is not None
+    assert cache.get(0) is None
+
+
+def test_unpicklable_item_not_cached(tmp_path):
+    cache = SignalCache(str(tmp_path))
+    cache.put("lock", threading.Lock())
+    assert cache.get("lock") is None
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import numpy as np
+from scipy.io import netcdf_file
+
+from pyxpad import datafile
+from pyxpad.datafile import HandlePool, NetCDFDataSource
+
+
+def write_file(filename, nt=101):
+    f = netcdf_file(filename, 'w')
+    f.createDimension('t', nt)
+    f.createDimension('x', 3)
+    t = f.createVariable('t', 'd', ('t',))
+    t[:] = np.linspace(0, 1, nt)
+    v = f.createVariable('v', 'd', ('t', 'x'))
+    v[:] = np.arange(nt * 3).reshape((nt, 3))
+    f.close()
+
+
+def test_pool_reuses_and_limits_open_files(tmp_path):
+    filenames = [str(tmp_path / "{}.nc".format(i)) for i in range(3)]
+    for filename in filenames:
+        write_file(filename)
+    pool = HandlePool(maxopen=2)
+
+    h = pool.acquire(filenames[0])
+    assert pool.acquire(filenames[0]) is h
+    pool.release(h)
+    pool.release(h)
+    for filename in filenames[1:]:
+        pool.release(pool.acquire(filenames[0]))
+        pool.release(pool.acquire(filename))
+    assert pool.closeIdle(timeout=1000) == 2
+    assert pool.closeIdle(timeout=0) == 0
+
+
+def test_reads_with_shared_library_lock_dont_deadlock(tmp_path, monkeypatch):
+    # As with netCDF4, where every file shares one lock
+    monkeypatch.setattr(datafile, 'library', 'netCDF4')
+    monkeypatch.setattr(datafile, 'handles', HandlePool(maxopen=1))
+    filenames = [str(tmp_path / "{}.nc".format(i)) for i in range(2)]
+    for filename in filenames:
+        write_file(filename)
+    sources = [NetCDFDataSource(filename) for filename in filenames]
+    stop = time.time() + 1.
+    errors = []
+
+    def reader(source):
+        try:
+            while time.time() < stop:
+                # Forget the dimension, so that window() reads it
+                source.dimensions['t'].data = None
+                item = source.read('v', '', trange=(0.2, 0.5))
+                assert item.data.shape == (31, 3)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(source,), daemon=True)
+               for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10.)
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import pytest
+
+from pyxpad import fakeuda, xpadsource
+from pyxpad.cache import SignalCache
+from pyxpad.reader import ReadJob, ReadRequest, reads
+from pyxpad.xpadsource import XPadSource
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    """An XPAD tree reading from the stand-in client, without a cache"""
+    monkeypatch.setattr(xpadsource, 'cache_dir', str(tmp_path / "cache"))
+    tree = tmp_path / "xpad"
+    tree.mkdir()
+    with open(str(tree / "mag.item"), 'w') as f:
+        f.write("Magnetics\n1\namc_plasma current $ Plasma current\n")
+    settings = {name: getattr(fakeuda.Client, name)
+                for name in ['latency', 'bandwidth', 'failureRate', 'hangRate',
+                             'hangTime', 'npoints']}
+    source = XPadSource(str(tree))
+    source.config['Cache'] = False
+    fakeuda.install(source, npoints=1000, seed=1)
+    fakeuda.resetStats()
+    reads.clear()
+    yield source
+    for name, value in settings.items():
+        setattr(fakeuda.Client, name, value)
+    reads.clear()
+
+
+def run(source, names, shot="29000", max_workers=4, **kwargs):
+    requests = [ReadRequest(source, name, shot, **kwargs) for name in names]
+    job = ReadJob(requests, max_workers=max_workers).start()
+    assert job.wait(timeout=30.)
+    return requests
+
+
+def test_transient_failures_retried(source):
+    fakeuda.install(source, failureRate=1.0)
+    req, = run(source, ["ip"], retries=2, backoff=0.01)
+    assert isinstance(req.error[1], ConnectionError)
+    assert fakeuda.Client.stats['gets'] == 3  # First try and two retries
+    assert fakeuda.Client.stats['failures'] == 3
+
+
+def test_read_succeeds_after_failures(source):
+    fakeuda.install(source, failureRate=0.5, seed=3)
+    req, = run(source, ["ip"], retries=20, backoff=0.001)
+    assert req.error is None
+    assert len(req.result.data) == 1000
+    stats = fakeuda.Client.stats
+    assert stats['gets'] == stats['failures'] + 1
+
+
+def test_hanging_read_abandoned(source):
+    fakeuda.install(source, hangRate=1.0, hangTime=2.)
+    started = time.time()
+    # Another shot, since later reads of this one would wait for it
+    req, = run(source, ["ip"], shot="29999", timeout=0.2)
+    assert time.time() - started < 1.5
+    assert isinstance(req.error[1], TimeoutError)
+    assert req.result is None
+
+
+def test_identical_reads_share_one_fetch(source):
+    fakeuda.install(source, latency=0.3)
+    requests = run(source, ["ip"] * 4)
+    assert fakeuda.Client.stats['gets'] == 1
+    first = requests[0].result
+    assert all(req.result.data is first.data for req in requests)
+    assert not first.data.flags.writeable
+
+
+def test_reads_overlap(source):
+    fakeuda.install(source, latency=0.3)
+    started = time.time()
+    requests = run(source, ["a", "b", "c", "d"], max_workers=4)
+    assert time.time() - started < 0.9  # Not 4 x 0.3 one after another
+    assert fakeuda.Client.stats['gets'] == 4
+    assert all(req.error is None for req in requests)
+
+
+def test_cached_signal_not_fetched_again(source, tmp_path, monkeypatch):
+    cache = SignalCache(str(tmp_path / "signals"))
+    monkeypatch.setattr(xpadsource, 'getCache', lambda maxsize=None: cache)
+    source.config['Cache'] = True
+    first = source.read("ip", "29000")
+    second = source.read("ip", "29000")
+    assert fakeuda.Client.stats['gets'] == 1
+    assert np.array_equal(first.data, second.data)
+    # Parts of the signal come from the cached whole signal
+    part = source.read("ip", "29000", npoints=100)
+    assert fakeuda.Client.stats['gets'] == 1
+    assert len(part.data) == 100
@@ -0,0 +1,39 @@
+import json
+
+import numpy as np
+
+from pyxpad.npysource import NpyDirSource
+
+
+def make_dir(path):
+    np.save(str(path / "raw.npy"), np.zeros(1000, dtype=np.int8))
+    np.save(str(path / "time.npy"), np.linspace(0.1, 0.6, 11))
+    np.save(str(path / "ne.npy"), np.zeros((11, 3)))
+    with open(str(path / "ne.json"), 'w') as f:
+        json.dump({"dims": [{"file": "time.npy", "label": "Time"}, {"name": "chan"}]}, f)
+    return NpyDirSource(str(path))
+
+
+def test_index_dimension_not_made(tmp_path):
+    source = make_dir(tmp_path)
+    item = source.read("raw", "")
+    assert item.time is None
+    assert item.dim[0]._data is None
+    assert item.data.dtype == np.int8
+
+
+def test_time_from_file(tmp_path):
+    source = make_dir(tmp_path)
+    item = source.read("ne", "", trange=(0.2, 0.4))
+    assert np.allclose(item.time, [0.2, 0.25, 0.3, 0.35, 0.4])
+    assert item.time is item.dim[0].data
+    assert item.dim[1]._data is None
+
+
+def test_probe_time_range(tmp_path):
+    source = make_dir(tmp_path)
+    info = source.probe("raw")
+    assert info.shape == (1000,)
+    assert info.trange == (0, 999)
+    info = source.probe("ne")
+    assert np.allclose(info.trange, (0.1, 0.6))
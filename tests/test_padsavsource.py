@@ -0,0 +1,39 @@
+import numpy as np
+
+from pyxpad.padsavsource import parse_trace
+from pyxpad.pyxpad_utils import UniformDim, timeValues
+
+
+def record(**fields):
+    """A one-element record array, as read from an IDL save file"""
+    return np.rec.array([tuple(fields.values())],
+                        dtype=[(name, object) for name in fields])
+
+
+def info(label, units):
+    return record(UTYPE=b'INFO', LABEL=label, UNITS=units)
+
+
+def test_uniform_timebase_2d():
+    nt, nx = 11, 3
+    data = np.arange(nx * nt, dtype=float).reshape((nx, nt))
+    tinfo = record(UTYPE=b'TINFO', DOMAINS=1, START=0.1, FINISH=0.6,
+                   STEP=0.05, SAMPLES=nt, LENGTH=nt, UNITS=b's', LABEL=b'Time')
+    trace = record(UTYPE=b'DBstructure', TYPE=b'f(t,x)', NAME=b'ayc_ne',
+                   SOURCE=b'29000', PROCESS=b'', SIZE=np.array([2, nt, nx]),
+                   DATA=data, DINFO=info(b'Density', b'm^-3'), TINFO=tinfo,
+                   X=np.linspace(0., 1., nx), XINFO=info(b'Radius', b'm'))
+
+    item = parse_trace(trace)
+
+    assert item.data.shape == (nt, nx)
+    assert item.order == 0
+    assert isinstance(item.dim[0], UniformDim)
+    # Time values are only made when needed
+    assert item.time is None
+    assert item.dim[0]._data is None
+    # Plots fall back to the time dimension
+    time = timeValues(item)
+    assert len(time) == item.data.shape[item.order]
+    assert np.allclose(time, np.linspace(0.1, 0.6, nt))
+    assert np.array_equal(item.dim[1].data, np.linspace(0., 1., nx))
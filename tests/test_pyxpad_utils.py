@@ -0,0 +1,32 @@
+import numpy as np
+
+from pyxpad.pyxpad_utils import XPadDataItem, XPadDataDim, UniformDim, internDims, timebases
+
+
+def item_with(dim):
+    item = XPadDataItem()
+    item.data = np.zeros(len(dim.data))
+    item.dim = [dim]
+    item.order = 0
+    item.time = dim.data
+    return item
+
+
+def test_intern_keeps_time_shared_with_uniform_dim():
+    item = internDims(item_with(UniformDim(0.1, 0.01, 100)))
+    assert item.time is item.dim[0].data
+    assert timebases.key(item.time) is None  # Not copied into the table
+
+
+def test_intern_plain_dims_and_time_together():
+    dim = XPadDataDim()
+    dim.data = np.linspace(0., 1., 100)
+    first = internDims(item_with(dim))
+    assert first.time is first.dim[0].data
+    assert not dim.data.flags.writeable
+
+    other = XPadDataDim()
+    other.data = np.linspace(0., 1., 100)
+    second = internDims(item_with(other))
+    assert second.dim[0].data is first.dim[0].data
+    assert second.time is first.time
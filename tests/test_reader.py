@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+import pytest
+
+from pyxpad.pyxpad_utils import XPadDataItem
+from pyxpad.reader import ReadJob, ReadRequest, reads
+
+
+class HangingSource:
+    """A source whose reads wait until released"""
+
+    label = "hanging"
+    config = {}
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def read(self, name, shot):
+        self.release.wait()
+        return None
+
+
+def test_abandoned_read_doesnt_block_exit():
+    source = HangingSource()
+    req = ReadRequest(source, "ip", "", timeout=0.1)
+    try:
+        job = ReadJob([req]).start()
+        assert job.wait(timeout=5.)
+        assert isinstance(req.error[1], TimeoutError)
+        # Still reading, but mustn't stop the interpreter exiting
+        workers = [thread for thread in threading.enumerate()
+                   if thread.name.startswith("ReadJob worker")]
+        assert workers
+        assert all(thread.daemon for thread in workers)
+    finally:
+        source.release.set()
+
+
+class CountingSource:
+    """A source of made-up signals, counting its reads"""
+
+    label = "counting"
+
+    def __init__(self):
+        self.config = {}
+        self.nreads = 0
+
+    def readKey(self, name, shot):
+        return (id(self), name, shot)
+
+    def read(self, name, shot):
+        self.nreads += 1
+        item = XPadDataItem()
+        item.name = name
+        item.data = np.arange(10.)
+        return item
+
+
+def test_shared_results_are_read_only():
+    source = CountingSource()
+    first = reads.read(source, "ip", "")
+    with pytest.raises(ValueError):
+        first.data[:] = 0.
+    # A copy can be changed without affecting later reads
+    changed = first.data.copy()
+    changed[:] = 0.
+    second = reads.read(source, "ip", "")
+    assert source.nreads == 1
+    assert np.array_equal(second.data, np.arange(10.))
@@ -0,0 +1,70 @@
+import pickle
+
+from pyxpad import xpadsource
+from pyxpad.pyxpad_utils import XPadDataItem
+from pyxpad.xpadsource import XPadSource
+
+
+class OldPickle:
+    """Pickles as an XPadSource with the given state"""
+
+    def __init__(self, state):
+        self.state = state
+
+    def __reduce__(self):
+        return (object.__new__, (XPadSource,), self.state)
+
+
+def old_item_file():
+    """Pickle of an item file source saved before the tree was read lazily"""
+    variables = {}
+    for name, desc in [("amc_plasma current", "Plasma current"),
+                       ("efm_q_95", "q95")]:
+        item = XPadDataItem()
+        item.name = name
+        item.label = item.desc = desc
+        item.source = "/xpad/mast.item"
+        variables[name] = item
+    state = {'label': "MAST",
+             'dimensions': {},
+             'varNames': list(variables.keys()),
+             'variables': variables,
+             'parent': None,
+             'config': {'Host': 'mast.fusion.org.uk', 'Port': 56565,
+                        'verbose': True, 'debug': False}}
+    return pickle.dumps(OldPickle(state))
+
+
+def test_old_pickle_saved_again():
+    source = pickle.loads(old_item_file())
+    assert source.varNames == ["amc_plasma current", "efm_q_95"]
+
+    # Saving again and loading must keep the variables
+    source = pickle.loads(pickle.dumps(source))
+    assert source.varNames == ["amc_plasma current", "efm_q_95"]
+    var = source.variables["efm_q_95"]
+    assert var.desc == "q95"
+    assert var.source == "/xpad/mast.item"
+
+
+def write_item(path, label, entries):
+    with open(path, 'w') as f:
+        f.write(label + "\n{}\n".format(len(entries)))
+        for name, desc in entries:
+            f.write("{} $ {}\n".format(name, desc))
+
+
+def test_variables_in_subdirectory(tmp_path, monkeypatch):
+    monkeypatch.setattr(xpadsource, 'cache_dir', str(tmp_path / "cache"))
+    tree = tmp_path / "xpad"
+    (tree / "sub").mkdir(parents=True)
+    write_item(str(tree / "top.item"), "Top", [("ip", "Top current")])
+    write_item(str(tree / "sub" / "mag.item"), "Magnetics",
+               [("ip", "Plasma current"), ("bt", "Toroidal field")])
+
+    root = XPadSource(str(tree))
+    sub = next(child for child in root.children if child.label == "sub")
+    assert sorted(sub.variables) == ["bt", "ip"]
+    assert sub.variables["ip"].desc == "Plasma current"
+    assert "ip" in root.variables
+    assert "bt" not in root.children[-1].variables